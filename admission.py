@@ -0,0 +1,156 @@
+import math
+import random
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """Raised when a call is refused admission; retry_after is a hint in whole seconds"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=10.0):
+    """Exponential backoff with full jitter for the given 1-based attempt
+
+    Spreading retries uniformly over [0, base * 2^(attempt-1)] keeps
+    clients that failed together from retrying together.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def call_with_retries(function, retries=2, base_delay=0.5, max_delay=10.0, retry_on=(Exception,), deadline=None):
+    """Call function, retrying failures with backoff until retries or the deadline run out"""
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except retry_on:
+            attempt += 1
+            if attempt > retries:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            # Do not start a retry whose wait alone would overrun the request
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+
+
+class Slot:
+    """One admitted call; release it exactly once, or use it as a context manager"""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._started)
+
+    # A response dropped before its body was sent still gives its slot back
+    __del__ = release
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """Cap concurrent calls to an external engine, with a bounded FIFO wait queue
+
+    Up to limit calls run at once and up to max_queue more wait for a
+    free slot, each for at most timeout seconds (or until its request
+    deadline). Anything beyond that is refused immediately with
+    Overloaded, so an overloaded engine sheds load instead of making
+    every request slower.
+    """
+
+    def __init__(self, name, limit=4, max_queue=16, timeout=10.0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._active = 0
+        self._waiters = []  # Events of queued callers, oldest first
+        self._lock = threading.RLock()  # Reentrant: Slot.__del__ may run while it is held
+
+        # Stats
+        self._admitted = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._peak_waiting = 0
+        self._wait_seconds = 0.0
+        self._avg_hold_seconds = 0.0
+
+    def retry_after(self):
+        """Seconds until a slot is likely free, from the average call time and queue depth"""
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self):
+        rounds = (len(self._waiters) + 1) / max(self.limit, 1)
+        return max(1, math.ceil(self._avg_hold_seconds * rounds))
+
+    def acquire(self, deadline=None):
+        """Wait for a slot and return it; raises Overloaded when full or out of time"""
+        started = time.monotonic()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self._admitted += 1
+                return Slot(self)
+            if len(self._waiters) >= self.max_queue:
+                self._rejected += 1
+                raise Overloaded(f"{self.name} is overloaded ({self._active} running, {len(self._waiters)} waiting)",
+                                 self._retry_after())
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            self._peak_waiting = max(self._peak_waiting, len(self._waiters))
+
+        limit = started + self.timeout
+        if deadline is not None:
+            limit = min(limit, deadline)
+        admitted = waiter.wait(max(0.0, limit - time.monotonic()))
+
+        with self._lock:
+            # _release may hand over the slot between the timeout and taking the lock
+            if not admitted and waiter.is_set():
+                admitted = True
+            if not admitted:
+                self._waiters.remove(waiter)
+                self._timeouts += 1
+                raise Overloaded(f"Timed out waiting for {self.name}", self._retry_after())
+            self._admitted += 1
+            self._wait_seconds += time.monotonic() - started
+        return Slot(self)
+
+    def _release(self, held_seconds):
+        with self._lock:
+            # Moving average of how long a call holds its slot, for Retry-After
+            self._avg_hold_seconds += 0.2 * (held_seconds - self._avg_hold_seconds)
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter so nobody can jump the queue
+                self._waiters.pop(0).set()
+            else:
+                self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'active': self._active,
+                'waiting': len(self._waiters),
+                'max_queue': self.max_queue,
+                'peak_waiting': self._peak_waiting,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+                'avg_wait_seconds': self._wait_seconds / self._admitted if self._admitted else 0.0,
+                'avg_hold_seconds': self._avg_hold_seconds,
+            }
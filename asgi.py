@@ -0,0 +1,487 @@
+"""ASGI entry point: serve the same routes from an event loop
+
+    uvicorn asgi:app --workers 4        (or: hypercorn asgi:app)
+
+The I/O-bound endpoints (uploads, conversions, transcriptions, voice
+file serving and listings) are implemented here with Quart and aiomysql,
+so a slow client or a slow database holds a coroutine instead of a
+thread. CPU-heavy and disk-bound steps (extract_text, compare_texts,
+synthesis, transcription) run on a bounded thread pool. Every other route falls
+through to the Flask app in main.py, which runs on asgiref's thread pool.
+
+As with the Flask app, multipart file parts are parsed straight into
+uploads.Upload objects while the body arrives, so each file is hashed,
+spooled and checked against MAX_UPLOAD_BYTES in one pass. Quart's own
+16 MiB request limit is turned off to match.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import aiomysql
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Request, Response, g, jsonify, request, send_file
+from quart.formparser import FormDataParser
+from werkzeug.exceptions import HTTPException
+
+import main
+from audio_responses import file_etag, set_cache_headers
+from document_store import INSERT_DOCUMENT, SELECT_DOCUMENT_ID, content_hash, document_row
+from admission import Overloaded
+from jobs import QueueFull
+from retention import shard_path
+from transcription import AudioDecodeError, RecognizerBusy, stitch_segments
+from uploads import Upload, UploadTooLarge, receive_upload
+
+ASGI_BLOCKING_WORKERS = int(os.environ.get('ASGI_BLOCKING_WORKERS', 8))  # Threads for CPU-heavy and blocking steps
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))  # Connections shared by every coroutine
+
+service = main.App('main')
+blocking_executor = ThreadPoolExecutor(max_workers=ASGI_BLOCKING_WORKERS, thread_name_prefix='asgi-blocking')
+db = None  # aiomysql pool, opened when the server starts
+
+
+def upload_stream(total_content_length, content_type, filename=None, content_length=None):
+    """Container for one file part; closed by close_uploads when the request ends"""
+    upload = Upload(filename)
+    g.setdefault('uploads', []).append(upload)
+    return upload
+
+
+class UploadFormDataParser(FormDataParser):
+    """Quart form parser that writes file parts into Uploads, like uploads.UploadRequest"""
+
+    def __init__(self, **kwargs):
+        super().__init__(stream_factory=upload_stream, **kwargs)
+
+
+class AsyncUploadRequest(Request):
+    form_data_parser_class = UploadFormDataParser
+
+
+async_app = Quart(__name__)
+async_app.request_class = AsyncUploadRequest
+async_app.config['SEND_FILE_MAX_AGE_DEFAULT'] = None  # Audio cache headers come from set_cache_headers
+async_app.config['MAX_CONTENT_LENGTH'] = None  # Uploads enforce MAX_UPLOAD_BYTES per file, as in main.py
+
+
+async def run_blocking(function, *args, **kwargs):
+    """Run a blocking helper from main.App without stalling the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, partial(function, *args, **kwargs))
+
+
+@async_app.before_serving
+async def open_database():
+    global db
+    config = dict(main.DB_CONFIG)
+    config['db'] = config.pop('database')
+    db = await aiomysql.create_pool(minsize=1, maxsize=ASYNC_DB_POOL_SIZE, **config)
+    main.start_worker()
+
+
+@async_app.after_serving
+async def close_database():
+    db.close()
+    await db.wait_closed()
+    await run_blocking(main.get_write_buffer().close)
+    blocking_executor.shutdown(wait=False)
+
+
+async def execute(query, params=(), fetch=None):
+    """Run one statement on a pooled connection; fetch is None, 'one' or 'all'"""
+    async with db.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            if fetch == 'one':
+                result = await cursor.fetchone()
+            elif fetch == 'all':
+                result = await cursor.fetchall()
+            else:
+                result = cursor.lastrowid
+            await conn.commit()
+            return result
+
+
+async def persist(statement, row):
+    """Async counterpart of main.persist, honouring WRITE_BEHIND"""
+    if main.WRITE_BEHIND:
+        # A full buffer flushes inline, so this can wait on the database too
+        await run_blocking(main.get_write_buffer().add, statement, row)
+    else:
+        await execute(statement, row)
+
+
+async def store_document(cursor, text):
+    """Async counterpart of document_store.store_document"""
+    digest = content_hash(text)
+    await cursor.execute(SELECT_DOCUMENT_ID, (digest,))
+    row = await cursor.fetchone()
+    if row:
+        return row[0]
+    await cursor.execute(INSERT_DOCUMENT, await run_blocking(document_row, text, digest))
+    return cursor.lastrowid
+
+
+async def index_documents(*documents):
+    """Add compared (text, name) documents to the search indexes on the blocking pool"""
+    for text, name in documents:
+        await run_blocking(service.index_document, text, name)
+
+
+async def receive(file, folder):
+    """Async counterpart of App.receive; the Upload is closed when the request ends"""
+    started = time.perf_counter()
+    upload = await run_blocking(receive_upload, file)
+    if upload is not file.stream:
+        # Parsed into an Upload already registered by upload_stream otherwise
+        g.setdefault('uploads', []).append(upload)
+    main.STAGE_SECONDS.observe(time.perf_counter() - started, 'save_file')
+    main.UPLOADED_BYTES.inc(upload.size, folder)
+    return upload
+
+
+@async_app.teardown_request
+async def close_uploads(exc):
+    for upload in g.get('uploads', ()):
+        upload.close()
+
+
+async def send_audio(path, immutable=False, as_attachment=False):
+    """Async counterpart of audio_responses.send_audio: ranges, strong ETag, cache headers"""
+    path = os.path.abspath(path)
+    etag = await run_blocking(file_etag, path)
+    response = await send_file(path, mimetype='audio/mpeg', as_attachment=as_attachment,
+                               attachment_filename=os.path.basename(path), add_etags=False)
+    response.set_etag(etag)
+    set_cache_headers(response, immutable)
+    return await response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(path))
+
+
+def flag(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def submit_job(kind, **params):
+    try:
+        job_id = main.get_job_queue().submit(kind, params)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+
+
+@async_app.before_request
+async def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@async_app.after_request
+async def record_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        main.REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                     request.method, str(response.status_code))
+    return response
+
+
+@async_app.route('/compare', methods=['POST'])
+async def compare_documents():
+    try:
+        files = await request.files
+        doc1_file = files.get('document1')
+        doc2_file = files.get('document2')
+        if not doc1_file or not doc2_file:
+            return jsonify({'error': 'Both documents must be provided'}), 400
+
+        pages = request.args.get('pages')
+        passages = service.passage_options(request.args)
+        if passages and (passages['min_words'] < 1 or passages['limit'] < 1):
+            return jsonify({'error': 'min_words and max_passages must be positive'}), 400
+
+        upload1, upload2 = await asyncio.gather(
+            receive(doc1_file, main.DOCUMENT_FOLDER), receive(doc2_file, main.DOCUMENT_FOLDER))
+        error = await run_blocking(service.page_range_error, pages, (upload1, doc1_file.filename),
+                                   (upload2, doc2_file.filename))
+        if error:
+            return jsonify({'error': error}), 400
+
+        if flag('async'):
+            return submit_job('compare', doc1_path=await run_blocking(service.keep_upload, upload1, main.DOCUMENT_FOLDER),
+                              doc1_name=doc1_file.filename,
+                              doc2_path=await run_blocking(service.keep_upload, upload2, main.DOCUMENT_FOLDER),
+                              doc2_name=doc2_file.filename,
+                              doc1_hash=upload1.content_hash, doc2_hash=upload2.content_hash, pages=pages,
+                              passages=passages)
+
+        doc1, doc2 = await asyncio.gather(
+            run_blocking(service.extract_text, upload1, doc1_file.filename, upload1.content_hash, pages),
+            run_blocking(service.extract_text, upload2, doc2_file.filename, upload2.content_hash, pages))
+        similarity_percentage = float(await run_blocking(service.compare_texts, doc1, doc2))
+
+        async with db.acquire() as conn:
+            async with conn.cursor() as cursor:
+                doc1_id = await store_document(cursor, doc1)
+                doc2_id = await store_document(cursor, doc2)
+                await cursor.execute("INSERT INTO document_comparisons (doc1_id, doc2_id, similarity_percentage) VALUES (%s, %s, %s)",
+                                     (doc1_id, doc2_id, similarity_percentage))
+                comparison_id = cursor.lastrowid
+                await conn.commit()
+
+        # Indexing does not affect the response, so it finishes after it; Quart logs any failure
+        async_app.add_background_task(index_documents, (doc1, doc1_file.filename), (doc2, doc2_file.filename))
+
+        result = {'similarity_percentage': similarity_percentage, 'comparison_id': comparison_id}
+        if passages:
+            result.update(await run_blocking(service.passage_report, doc1, doc2, **passages))
+        return jsonify(result)
+
+    except UploadTooLarge as e:
+        return jsonify({'error': e.description}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@async_app.route('/convert', methods=['POST'])
+async def convert_text_to_speech():
+    try:
+        files = await request.files
+        if 'file' not in files:
+            return jsonify({'error': 'No file part'}), 400
+        file = files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+        if not service.allowed_file(file.filename):
+            return jsonify({'error': 'Unsupported file format'}), 400
+
+        pages = request.args.get('pages')
+        upload = await receive(file, main.UPLOAD_FOLDER)
+        error = await run_blocking(service.page_range_error, pages, (upload, file.filename))
+        if error:
+            return jsonify({'error': error}), 400
+
+        if flag('async'):
+            return submit_job('convert', file_path=await run_blocking(service.keep_upload, upload, main.UPLOAD_FOLDER),
+                              filename=file.filename, content_hash=upload.content_hash, pages=pages)
+
+        base_filename = os.path.splitext(file.filename)[0]
+        input_text = await run_blocking(service.extract_text, upload, file.filename, upload.content_hash, pages)
+        if not input_text.strip():
+            return jsonify({'error': 'No text found in the document'}), 400
+
+        if flag('stream') or request.accept_mimetypes.best == 'audio/mpeg':
+            return await stream_speech(base_filename, input_text)
+
+        output_file_path = await run_blocking(service.convert_to_speech, input_text, main.VOICE_FOLDER, base_filename)
+        if not output_file_path:
+            return jsonify({'error': 'Failed to generate MP3'}), 500
+
+        await save_voice_file(output_file_path)
+        response = await send_audio(output_file_path, as_attachment=True)
+        response.headers['X-Audio-URL'] = f'/audio/{service.speech_key(input_text)}.mp3'
+        return response
+
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    except UploadTooLarge as e:
+        return jsonify({'error': e.description}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+async def stream_speech(filename, text):
+    """Send MP3 segments as the synthesizer produces them, stepping it on the blocking pool"""
+    output_file = shard_path(main.VOICE_FOLDER, f'{filename}.mp3')
+    key = service.speech_key(text)
+    audio_url = f'/audio/{key}.mp3'
+    tts_cache = main.get_tts_cache()
+    # Lookups stat and touch the file, and may rescan the cache folder; copy_to is None when
+    # another worker evicted the entry in between, and the text is then synthesized again
+    if (await run_blocking(tts_cache.get, key) is not None
+            and await run_blocking(tts_cache.copy_to, key, output_file) is not None):
+        await save_voice_file(output_file)
+        response = await send_audio(output_file, as_attachment=True)
+        response.headers['X-Audio-URL'] = audio_url
+        return response
+
+    # Admit before the response starts so an overloaded engine can still answer 429
+    deadline = time.monotonic() + main.TTS_REQUEST_DEADLINE
+    slot = await run_blocking(main.tts_admission.acquire, deadline)
+    segments = service.iter_speech(output_file, [text], deadline)
+    done = object()
+    # The first segment comes before the response starts, so an engine failure is still a JSON error
+    try:
+        first = await run_blocking(next, segments, done)
+    except BaseException:
+        await run_blocking(segments.close)
+        slot.release()
+        raise
+
+    async def generate():
+        segment = first
+        try:
+            while segment is not done:
+                yield segment
+                segment = await run_blocking(next, segments, done)
+        finally:
+            await run_blocking(segments.close)
+            slot.release()
+
+    return Response(generate(), mimetype='audio/mpeg', headers={
+        'Content-Disposition': f'attachment; filename={os.path.basename(output_file)}',
+        'X-Accel-Buffering': 'no',
+        'X-Audio-URL': audio_url,
+    })
+
+
+async def save_voice_file(output_file_path):
+    filename = os.path.basename(output_file_path)
+    await persist("""
+        INSERT INTO voice_files (filename, file_path) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE file_path = VALUES(file_path), created_at = CURRENT_TIMESTAMP
+    """, (filename, output_file_path))
+    main.voice_paths.put(filename, output_file_path)
+    main.get_retention().record(output_file_path)
+
+
+@async_app.route('/voice/<filename>', methods=['GET'])
+async def serve_voice(filename):
+    try:
+        file_path = main.voice_paths.get(filename)
+        if file_path is None:
+            row = await execute("SELECT file_path FROM voice_files WHERE filename = %s", (filename,), fetch='one')
+            if row:
+                file_path = row[0]
+                main.voice_paths.put(filename, file_path)
+
+        if file_path and os.path.exists(file_path):
+            main.get_retention().touch(file_path)
+            return await send_audio(file_path)
+        main.voice_paths.discard(filename)
+        return jsonify({"error": "File not found"}), 404
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@async_app.route('/audio/<key>.mp3', methods=['GET'])
+async def serve_audio(key):
+    try:
+        if not re.fullmatch(r'[0-9a-f]{64}', key):
+            return jsonify({"error": "File not found"}), 404
+        file_path = main.get_tts_cache().path_for(key)
+        if not os.path.exists(file_path):
+            return jsonify({"error": "File not found"}), 404
+        return await send_audio(file_path, immutable=True)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@async_app.route('/voices', methods=['GET'])
+async def get_all_voice_files():
+    try:
+        limit = request.args.get('limit', main.VOICE_LIST_DEFAULT_LIMIT, type=int)
+        after = request.args.get('after', 0, type=int)
+        if limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+        limit = min(limit, main.VOICE_LIST_MAX_LIMIT)
+
+        files = await execute("SELECT id, filename, file_path, created_at FROM voice_files WHERE id > %s ORDER BY id LIMIT %s",
+                              (after, limit + 1), fetch='all')
+        has_more = len(files) > limit
+        files = files[:limit]
+        return jsonify({
+            'files': [{'id': file[0], 'filename': file[1], 'file_path': file[2],
+                       'created_at': str(file[3]) if file[3] else None} for file in files],
+            'next_after': files[-1][0] if has_more else None,
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+async def transcribe_upload():
+    """Save the 'audio' upload and transcribe it; returns (path, segments) or an error response"""
+    files = await request.files
+    file = files.get('audio')
+    if not file:
+        return None, (jsonify({"error": "No audio file provided"}), 400)
+    upload = await receive(file, main.AUDIO_FOLDER)
+    file_path = await run_blocking(service.keep_upload, upload, main.AUDIO_FOLDER)
+    return file_path, await run_blocking(service.transcribe_segments, file_path)
+
+
+def transcription_error(e):
+    if isinstance(e, RecognizerBusy):
+        return jsonify({"error": str(e)}), 503
+    if isinstance(e, AudioDecodeError):
+        return jsonify({"error": str(e)}), 400
+    if isinstance(e, UploadTooLarge):
+        return jsonify({"error": e.description}), 413
+    return jsonify({"error": str(e)}), 500
+
+
+@async_app.route('/transcribe', methods=['POST'])
+async def transcribe_audio():
+    try:
+        file_path, segments = await transcribe_upload()
+        if file_path is None:
+            return segments
+        transcribed_text = stitch_segments(segments)
+        await persist("INSERT INTO transcribed_text (text) VALUES (%s)", (transcribed_text,))
+        return jsonify({"message": "Audio transcribed successfully", "transcribed_text": transcribed_text})
+
+    except Exception as e:
+        return transcription_error(e)
+
+
+@async_app.route('/speech_to_text', methods=['POST'])
+async def create_speech_to_text():
+    try:
+        file_path, segments = await transcribe_upload()
+        if file_path is None:
+            return segments
+        transcribed_text = stitch_segments(segments)
+        duration = segments[-1]['end'] if segments else 0.0
+        await persist("""
+            INSERT INTO speech_to_text (audio_file_path, transcribed_text, segments, duration_seconds)
+            VALUES (%s, %s, %s, %s)
+        """, (file_path, transcribed_text, json.dumps(segments, ensure_ascii=False), duration))
+        return jsonify({"message": "Audio transcribed successfully", "transcribed_text": transcribed_text,
+                        "segments": segments, "duration_seconds": duration})
+
+    except Exception as e:
+        return transcription_error(e)
+
+
+@async_app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return Response(main.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+class RouteDispatcher:
+    """Send requests for routes implemented above to Quart and everything else to Flask"""
+
+    def __init__(self, async_app, wsgi_app):
+        self.async_app = async_app
+        self.fallback = WsgiToAsgi(wsgi_app)
+
+    def handles(self, scope):
+        adapter = self.async_app.url_map.bind('')
+        try:
+            adapter.match(scope['path'], method=scope['method'])
+            return True
+        except HTTPException:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.handles(scope):
+            return await self.fallback(scope, receive, send)
+        # Lifespan events go to Quart so the database pool opens and closes with the server
+        return await self.async_app(scope, receive, send)
+
+
+app = RouteDispatcher(async_app, service.app)
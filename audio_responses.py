@@ -0,0 +1,50 @@
+import os
+
+from flask import send_file
+
+from extraction_cache import hash_file
+from lru_map import LRUMap
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Content-addressed audio never changes
+
+# (path, inode, size, mtime) -> content hash, so hot files are hashed once
+_etags = LRUMap(8192)
+
+
+def file_etag(path):
+    """Strong ETag for a file, derived from its content hash"""
+    stat = os.stat(path)
+    signature = (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    etag = _etags.get(signature)
+    if etag is None:
+        etag = hash_file(path)
+        _etags.put(signature, etag)
+    return etag
+
+
+def send_audio(path, immutable=False, **kwargs):
+    """Send an MP3 with byte-range support, a strong ETag and cache headers
+
+    send_file answers Range requests with 206 and If-None-Match /
+    If-Modified-Since with 304. Full-file bodies go through the server's
+    wsgi.file_wrapper (sendfile under gunicorn), or are handed off via
+    X-Sendfile when USE_X_SENDFILE is enabled.
+    """
+    # Relative paths would otherwise resolve against the app's root, not the working directory
+    path = os.path.abspath(path)
+    response = send_file(path, mimetype='audio/mpeg', conditional=True, etag=file_etag(path), **kwargs)
+    return set_cache_headers(response, immutable)
+
+
+def set_cache_headers(response, immutable=False):
+    """Cache forever for content-addressed audio, otherwise revalidate every time"""
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # The name may be regenerated with new audio; revalidating is a cheap 304
+        response.cache_control.public = None
+        response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,433 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FOLDER = os.path.join(REPO_DIR, 'samples')  # Outside every folder the retention service manages
+SAMPLES = ('sinhala.txt', 'test2.txt', 'project.docx', 'testing_document.txt')
+
+# Final schema after every migration in migrations.py, in SQLite dialect; keep the two in sync
+SQLITE_SCHEMA = """
+CREATE TABLE document_comparisons (id INTEGER PRIMARY KEY AUTOINCREMENT, doc1_id INT, doc2_id INT,
+                                   similarity_percentage FLOAT);
+CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, content_hash CHAR(64) NOT NULL UNIQUE,
+                        text_compressed BLOB NOT NULL, text_length INT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE voice_files (id INTEGER PRIMARY KEY AUTOINCREMENT, filename VARCHAR(255) UNIQUE, file_path VARCHAR(255),
+                          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE transcribed_text (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT,
+                               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE speech_to_text (id INTEGER PRIMARY KEY AUTOINCREMENT, audio_file_path VARCHAR(255), transcribed_text TEXT,
+                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, segments TEXT, duration_seconds FLOAT);
+"""
+UNIQUE_KEYS = {'documents': 'content_hash', 'voice_files': 'filename'}  # Conflict targets for upserts
+
+_INSERT_TABLE = re.compile(r'INSERT INTO (\w+)')
+_VALUES_REF = re.compile(r'VALUES\((\w+)\)')
+
+
+def to_sqlite(query):
+    """Translate the MySQL statements the service issues into SQLite"""
+    query = query.replace('%s', '?')
+    if 'ON DUPLICATE KEY UPDATE' not in query:
+        return query
+    head, update = query.split('ON DUPLICATE KEY UPDATE', 1)
+    if 'LAST_INSERT_ID' in update:
+        # Callers look the row up first, so a conflict here is a lost race
+        return head + 'ON CONFLICT DO NOTHING'
+    table = _INSERT_TABLE.search(head).group(1)
+    update = _VALUES_REF.sub(r'excluded.\1', update)
+    return f"{head}ON CONFLICT({UNIQUE_KEYS[table]}) DO UPDATE SET {update}"
+
+
+class SQLiteCursor:
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, query, params=()):
+        return self.cursor.execute(to_sqlite(query), tuple(params))
+
+    def executemany(self, query, rows):
+        return self.cursor.executemany(to_sqlite(query), [tuple(row) for row in rows])
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    def close(self):
+        self.cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+
+class SQLiteConnection:
+    """Just enough of a mysql.connector connection for the service's queries"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self, **kwargs):
+        return SQLiteCursor(self.conn)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+class StubTTS:
+    """Stands in for gTTS: deterministic MP3-sized output, optional per-chunk latency"""
+
+    latency = 0.0
+
+    def __init__(self, text, lang='en', **kwargs):
+        self.text = text
+
+    def write_to_fp(self, fp):
+        if self.latency:
+            time.sleep(self.latency)
+        # Roughly the size of real speech: ~1 KB of MP3 per 16 characters
+        fp.write(b'ID3' + self.text.encode('utf-8') * 64)
+
+
+def load_service(workspace, tts_latency, stt_factor):
+    """Import main inside a scratch directory with SQLite and stub engines wired in"""
+    os.chdir(workspace)
+    os.environ.update(STT_BACKEND='stub', STT_STUB_REALTIME_FACTOR=str(stt_factor), JOB_BACKEND='memory')
+    StubTTS.latency = tts_latency
+    sys.modules['gtts'] = types.SimpleNamespace(gTTS=StubTTS)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import main
+
+    db_path = os.path.join(workspace, 'service.sqlite3')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SQLITE_SCHEMA)
+    conn.close()
+    db_pool = main.get_db_pool()
+    db_pool.close_all()
+    db_pool.factory = lambda: SQLiteConnection(db_path)
+    return main
+
+
+def synthetic_text(chars, generator, vocabulary):
+    """Sentences and paragraphs of random words, about chars long"""
+    paragraphs, paragraph, sentence, length = [], [], [], 0
+    while length < chars:
+        word = generator.choice(vocabulary)
+        sentence.append(word)
+        length += len(word) + 1
+        if len(sentence) >= generator.randint(8, 20):
+            paragraph.append(' '.join(sentence).capitalize() + '.')
+            sentence = []
+            if len(paragraph) >= generator.randint(3, 8):
+                paragraphs.append(' '.join(paragraph))
+                paragraph = []
+    if sentence:
+        paragraph.append(' '.join(sentence).capitalize() + '.')
+    if paragraph:
+        paragraphs.append(' '.join(paragraph))
+    return '\n\n'.join(paragraphs)
+
+
+def mutate(text, rate, generator, vocabulary):
+    words = text.split(' ')
+    return ' '.join(generator.choice(vocabulary) if generator.random() < rate else word for word in words)
+
+
+def as_pdf(text):
+    import fitz
+
+    pdf = fitz.open()
+    for start in range(0, len(text), 3000):
+        page = pdf.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text[start:start + 3000], fontsize=8)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def as_docx(text):
+    from docx import Document
+
+    document = Document()
+    for paragraph in text.split('\n\n'):
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def synthetic_wav(seconds, sample_rate=16000):
+    """Tone bursts separated by short pauses, so silence-based segmentation has work to do"""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = (3000 * np.sin(2 * np.pi * 220 * t) * ((t % 7) < 6.5)).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(audio.tobytes())
+    return buffer.getvalue()
+
+
+def upload(data, filename):
+    return (io.BytesIO(data), filename)
+
+
+def build_cases(args):
+    """(scenario, size label, request builder) for every benchmark case
+
+    Builders take the iteration number and return (method, url, kwargs).
+    Uncached scenarios vary the content per iteration so cache hits do not
+    flatter the numbers; *_cached scenarios repeat the same input.
+    """
+    generator = random.Random(args.seed)
+    vocabulary = [''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(generator.randint(2, 10)))
+                  for _ in range(5000)]
+    cases = []
+
+    for size in args.sizes:
+        base = synthetic_text(size, generator, vocabulary)
+        other = mutate(base, 0.1, generator, vocabulary)
+        label = f'{size}_chars'
+
+        def compare(i, base=base, other=other):
+            return 'POST', '/compare', {'data': {'document1': upload(f'{i} {base}'.encode(), 'a.txt'),
+                                                 'document2': upload(f'{i} {other}'.encode(), 'b.txt')}}
+
+        def convert(i, base=base):
+            return 'POST', '/convert', {'data': {'file': upload(f'Run {i}. {base}'.encode(), f'bench_{i}.txt')}}
+
+        def convert_stream(i, base=base):
+            return 'POST', '/convert?stream=1', {'data': {'file': upload(f'Stream {i}. {base}'.encode(),
+                                                                        f'stream_{i}.txt')}}
+
+        def convert_cached(i, base=base):
+            return 'POST', '/convert', {'data': {'file': upload(base.encode(), 'cached.txt')}}
+
+        def search(i, base=base):
+            return 'POST', '/search', {'data': {'document': upload(base.encode(), 'q.txt')}}
+
+        def near_duplicates(i, other=other):
+            return 'POST', '/near_duplicates', {'data': {'document': upload(other.encode(), 'q.txt')}}
+
+        cases += [('compare', label, compare), ('convert', label, convert), ('convert_stream', label, convert_stream),
+                  ('convert_cached', label, convert_cached), ('search', label, search),
+                  ('near_duplicates', label, near_duplicates)]
+
+    # Extraction cost by format at the middle size
+    size = args.sizes[len(args.sizes) // 2]
+    base = synthetic_text(size, generator, vocabulary)
+    for extension, encode in (('pdf', as_pdf), ('docx', as_docx)):
+        def compare_format(i, base=base, extension=extension, encode=encode):
+            return 'POST', '/compare', {'data': {'document1': upload(encode(f'{i} {base}'), f'a.{extension}'),
+                                                 'document2': upload(encode(f'{i} x {base}'), f'b.{extension}')}}
+        cases.append((f'compare_{extension}', f'{size}_chars', compare_format))
+
+    batch = [synthetic_text(size, generator, vocabulary) for _ in range(args.batch_documents)]
+
+    def compare_batch(i):
+        files = [upload(f'{i} {text}'.encode(), f'd{n}.txt') for n, text in enumerate(batch)]
+        return 'POST', '/compare_batch', {'data': {'documents': files}}
+    cases.append(('compare_batch', f'{len(batch)}x{size}_chars', compare_batch))
+
+    for seconds in args.audio_seconds:
+        audio = synthetic_wav(seconds)
+
+        def transcribe(i, audio=audio):
+            return 'POST', '/transcribe', {'data': {'audio': upload(audio, f'bench_{i}.wav')}}
+
+        def speech_to_text(i, audio=audio):
+            return 'POST', '/speech_to_text', {'data': {'audio': upload(audio, f'bench_{i}.wav')}}
+
+        cases += [('transcribe', f'{seconds}s', transcribe), ('speech_to_text', f'{seconds}s', speech_to_text)]
+
+    # The sample inputs shipped in samples/
+    for name in SAMPLES:
+        with open(os.path.join(SAMPLE_FOLDER, name), 'rb') as f:
+            data = f.read()
+
+        def convert_sample(i, data=data, name=name):
+            return 'POST', '/convert', {'data': {'file': upload(data, name)}}
+        cases.append(('convert_sample', name, convert_sample))
+
+    cases.append(('voices', 'page', lambda i: ('GET', '/voices?limit=100', {})))
+    cases.append(('serve_voice_range', 'cached.mp3',
+                  lambda i: ('GET', '/voice/cached.mp3', {'headers': {'Range': 'bytes=0-65535'}})))
+
+    if args.only:
+        cases = [case for case in cases if case[0] in args.only]
+    return cases
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_case(app, build, iterations, concurrency, warmup):
+    """Drive one case through the test client; returns latencies and error count"""
+    local = threading.local()
+
+    def call(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        method, url, kwargs = build(i)
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()  # Drain streamed bodies
+        return time.perf_counter() - started, response.status_code
+
+    for i in range(warmup):
+        call(-1 - i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(call, range(iterations)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in outcomes)
+    errors = sum(1 for _, status in outcomes if status >= 400)
+    return latencies, errors, elapsed
+
+
+def peak_memory(app, build):
+    """Peak Python allocation while serving a single request"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        method, url, kwargs = build(10 ** 6)
+        app.test_client().open(url, method=method, **kwargs).get_data()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    workspace = tempfile.mkdtemp(prefix='dylexsia_bench_')
+    cwd = os.getcwd()
+    try:
+        main = load_service(workspace, args.tts_latency, args.stt_realtime_factor)
+        app = main.create_app()
+        results = []
+        for scenario, size, build in build_cases(args):
+            latencies, errors, elapsed = run_case(app, build, args.iterations, args.concurrency, args.warmup)
+            result = {
+                'scenario': scenario,
+                'size': size,
+                'iterations': len(latencies),
+                'concurrency': args.concurrency,
+                'errors': errors,
+                'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'peak_traced_bytes': peak_memory(app, build) if args.memory else None,
+            }
+            results.append(result)
+            print(f"{scenario:<18} {size:<22} p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+                  f"{result['throughput_rps']:8.1f} req/s  errors {errors}", file=sys.stderr)
+        return {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'results': results,
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def compare_runs(baseline, current):
+    """Print p50/p99/throughput changes against an earlier results file"""
+    previous = {(r['scenario'], r['size']): r for r in baseline['results']}
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for result in current['results']:
+        before = previous.get((result['scenario'], result['size']))
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            changes.append(f'{key} {change:+6.1f}%')
+        print(f"{result['scenario']:<18} {result['size']:<22} " + '  '.join(changes))
+
+
+def parse_list(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the service endpoints with SQLite and stub engines')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--sizes', type=parse_list(int), default=[1000, 10000, 100000],
+                        help='Synthetic document sizes in characters, comma separated')
+    parser.add_argument('--audio-seconds', type=parse_list(float), default=[5, 60],
+                        help='Synthetic audio durations, comma separated')
+    parser.add_argument('--batch-documents', type=int, default=10)
+    parser.add_argument('--tts-latency', type=float, default=0.0, help='Seconds the stub TTS sleeps per chunk')
+    parser.add_argument('--stt-realtime-factor', type=float, default=0.0,
+                        help='Seconds the stub recognizer sleeps per second of audio')
+    parser.add_argument('--only', type=parse_list(str), help='Run only these scenarios, comma separated')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Skip the tracemalloc pass')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            compare_runs(json.load(f), report)
@@ -0,0 +1,277 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import uuid
+from collections import Counter
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from sklearn.preprocessing import normalize
+
+from document_store import content_hash
+from tokenizer import TOKENIZER_VERSION, tokenize
+
+
+class CorpusIndex:
+    """Persistent TF-IDF index over every stored document
+
+    Term counts are appended to a JSON-lines log, so adding a document never
+    rewrites the corpus. The vocabulary and document frequencies grow
+    incrementally, and IDF weights are applied when the corpus is searched
+    rather than stored with each document. Other processes' additions are picked up by
+    reading the new tail of the log before each search.
+
+    The first line of the log records the tokenizer version, since stored
+    terms are only comparable with queries tokenized the same way, and a
+    generation that changes whenever the log is rebuilt, so every process
+    reloads from scratch instead of reading on from a stale offset.
+
+    The weighted matrix is not rebuilt on every add: rows added since the
+    last build are weighted with that build's IDF in a separate block, and IDF
+    is only recomputed over the whole corpus once those rows exceed
+    rebuild_fraction of it. Scores drift slightly from exact TF-IDF in
+    between, since document frequencies change little per document.
+    """
+
+    def __init__(self, folder, rebuild_fraction=0.1):
+        self.folder = folder
+        self.rebuild_fraction = rebuild_fraction
+        self.log_path = os.path.join(folder, 'documents.jsonl')
+        # Same tokenization as compare_texts so scores are comparable
+        self.analyzer = tokenize
+
+        self.vocabulary = {}  # term -> column
+        self.doc_freq = []  # column -> number of documents containing the term
+        self.keys = []  # row -> document key
+        self.names = []  # row -> original filename
+        self._rows = {}  # document key -> row
+        self._indices = []  # row -> term columns
+        self._counts = []  # row -> term counts
+        self._matrix = None  # Cached L2-normalized TF-IDF rows as of the last full build
+        self._tail = None  # Rows added since, weighted with the same IDF
+        self._idf = None  # IDF per column, as of the last full build
+        self._idf_docs = 0  # Documents the IDF was computed over
+        self.rebuilds = 0
+        self._header = None  # First line of the log loaded so far
+        self._offset = 0  # Bytes of the log already loaded
+        self._lock = threading.RLock()
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._create_log()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add_row(self, key, name, counts):
+        if key in self._rows:
+            return
+        columns = []
+        for term in counts:
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = self.vocabulary[term] = len(self.doc_freq)
+                self.doc_freq.append(0)
+            self.doc_freq[column] += 1
+            columns.append(column)
+        self._rows[key] = len(self.keys)
+        self.keys.append(key)
+        self.names.append(name)
+        self._indices.append(np.asarray(columns, dtype=np.int32))
+        self._counts.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+
+    @staticmethod
+    def _new_header():
+        header = {'format': 1, 'tokenizer': TOKENIZER_VERSION, 'generation': uuid.uuid4().hex}
+        return (json.dumps(header) + '\n').encode('utf-8')
+
+    def _create_log(self):
+        with open(self.log_path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Only the first process to get here writes the header
+                if os.fstat(f.fileno()).st_size == 0:
+                    f.write(self._new_header())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _check_header(self, header):
+        try:
+            meta = json.loads(header)
+        except ValueError:
+            meta = {}
+        # Logs from before the header start straight with a document
+        if 'key' in meta or meta.get('tokenizer') != TOKENIZER_VERSION:
+            raise ValueError(f'{self.log_path} was built with a different tokenizer; run a reindex')
+
+    def _clear(self):
+        self.vocabulary = {}
+        self.doc_freq = []
+        self.keys = []
+        self.names = []
+        self._rows = {}
+        self._indices = []
+        self._counts = []
+        self._matrix = None
+        self._tail = None
+        self._idf = None
+        self._idf_docs = 0
+
+    def refresh(self):
+        """Load documents appended to the log since the last read, or all of a rebuilt log"""
+        with self._lock:
+            if not os.path.exists(self.log_path):
+                return
+            with open(self.log_path, 'rb') as f:
+                header = f.readline()
+                if not header.endswith(b'\n'):
+                    return  # Still being created
+                if header != self._header:
+                    self._check_header(header)
+                    self._clear()
+                    self._header = header
+                    self._offset = len(header)
+                if os.fstat(f.fileno()).st_size == self._offset:
+                    return
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # Another process is mid-write; read it next time
+                    self._offset += len(line)
+                    record = json.loads(line)
+                    self._add_row(record['key'], record['name'], record['terms'])
+
+    def add(self, text, name=None):
+        """Add a document to the corpus and return its key"""
+        key = content_hash(text)
+        with self._lock:
+            self.refresh()
+            if key in self._rows:
+                return key
+            counts = dict(Counter(self.analyzer(text)))
+            line = (json.dumps({'key': key, 'name': name, 'terms': counts}, ensure_ascii=False) + '\n').encode('utf-8')
+            # Never create the log here: one removed by a reindex must come back with its header
+            with os.fdopen(os.open(self.log_path, os.O_WRONLY | os.O_APPEND), 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(line)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            # Other processes may have appended before us; pick their rows up in order
+            self.refresh()
+        return key
+
+    def reset(self):
+        """Replace the log with an empty one so the corpus can be rebuilt"""
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._new_header())
+            # Atomic, so other processes see the old log or the new one, never a mix
+            os.replace(tmp_path, self.log_path)
+            self.refresh()
+
+    def _weighted_rows(self, start, stop):
+        """Row-normalized TF-IDF rows start..stop, weighted with the current IDF"""
+        indptr = np.zeros(stop - start + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in self._indices[start:stop]], out=indptr[1:])
+        counts = csr_matrix((np.concatenate(self._counts[start:stop]), np.concatenate(self._indices[start:stop]), indptr),
+                            shape=(stop - start, len(self.doc_freq)))
+        return normalize(counts @ diags(self._idf), copy=False)
+
+    def _weighted_blocks(self):
+        """Row-normalized TF-IDF rows as (rows of the last full build, rows added since or None)"""
+        n_docs = len(self.keys)
+        built = self._matrix.shape[0] if self._matrix is not None else 0
+        if self._matrix is None or n_docs - built > self.rebuild_fraction * built:
+            doc_freq = np.asarray(self.doc_freq, dtype=np.float64)
+            # Smoothed IDF, matching TfidfVectorizer's defaults
+            self._idf = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+            self._idf_docs = n_docs
+            self._matrix = self._weighted_rows(0, n_docs)
+            self._tail = None
+            self.rebuilds += 1
+        elif n_docs > built and (self._tail is None or self._tail.shape[0] != n_docs - built):
+            # Terms first seen since the build get the IDF of a term no built document has
+            self._idf = np.concatenate([self._idf, np.full(len(self.doc_freq) - len(self._idf),
+                                                           np.log(1 + self._idf_docs) + 1)])
+            self._tail = self._weighted_rows(built, n_docs)
+        return self._matrix, self._tail
+
+    def _scores(self, query, rows=None):
+        """Cosine similarity of the query with every document, or with the given rows in order"""
+        matrix, tail = self._weighted_blocks()
+        built = matrix.shape[0]
+        # Built rows have no weight in columns added since, so the query is cut to their width
+        blocks = [(matrix, query[:, :matrix.shape[1]], 0)]
+        if tail is not None:
+            blocks.append((tail, query, built))
+        if rows is None:
+            return np.concatenate([(block @ part.T).toarray().ravel() for block, part, _ in blocks])
+        rows = np.asarray(rows)
+        scores = np.zeros(len(rows))
+        for block, part, first in blocks:
+            selected = (rows >= first) & (rows < first + block.shape[0])
+            if selected.any():
+                scores[selected] = (block[rows[selected] - first] @ part.T).toarray().ravel()
+        return scores
+
+    def _query_vector(self, text):
+        """L2-normalized TF-IDF row for text in the corpus' term space"""
+        counts = Counter(self.analyzer(text))
+        columns, weights = [], []
+        unseen = 0.0
+        unseen_idf = np.log(1 + self._idf_docs) + 1
+        for term, count in counts.items():
+            column = self.vocabulary.get(term)
+            if column is None:
+                # Terms outside the corpus only contribute to the query norm
+                unseen += (count * unseen_idf) ** 2
+            else:
+                columns.append(column)
+                weights.append(count * self._idf[column])
+        weights = np.asarray(weights, dtype=np.float64)
+        norm = np.sqrt(np.dot(weights, weights) + unseen)
+        if not columns or norm == 0:
+            return None
+        return csr_matrix((weights / norm, (np.zeros(len(columns), dtype=np.int32), columns)),
+                          shape=(1, len(self.doc_freq)))
+
+    def search(self, text, k=5):
+        """Return the k stored documents most similar to text"""
+        with self._lock:
+            self.refresh()
+            if not self.keys:
+                return []
+            self._weighted_blocks()
+            query = self._query_vector(text)
+            if query is None:
+                return []
+
+            # Sparse matrix-vector products score the whole corpus
+            scores = self._scores(query)
+
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [{'key': self.keys[row], 'name': self.names[row],
+                     'similarity_percentage': float(scores[row] * 100)} for row in top]
+
+    def similarity(self, text, keys):
+        """Score text against only the given stored documents"""
+        with self._lock:
+            self.refresh()
+            rows = [self._rows[key] for key in keys if key in self._rows]
+            if not rows:
+                return []
+            self._weighted_blocks()
+            query = self._query_vector(text)
+            if query is None:
+                return [{'key': self.keys[row], 'name': self.names[row], 'similarity_percentage': 0.0}
+                        for row in rows]
+            scores = self._scores(query, rows)
+            return [{'key': self.keys[row], 'name': self.names[row],
+                     'similarity_percentage': float(score * 100)} for row, score in zip(rows, scores)]
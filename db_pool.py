@@ -0,0 +1,167 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class PoolTimeout(Error):
+    """Raised when no connection could be checked out before the timeout"""
+
+
+class ConnectionPool:
+    """Process-wide, size-limited pool of MySQL connections"""
+
+    def __init__(self, size=5, timeout=10.0, recycle=3600, factory=None, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.connect_args = connect_args
+        self.factory = factory or (lambda: mysql.connector.connect(**self.connect_args))
+
+        self._lock = threading.Condition()
+        self._idle = []  # (connection, created_at) pairs ready for reuse
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        # Stats
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _healthy(self, conn, created_at):
+        """Check that an idle connection is still usable"""
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            return False
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Check out a connection, opening a new one if the pool is not full"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._lock:
+            self._waiting += 1
+            try:
+                while not self._idle and self._opened >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(msg=f"Timed out waiting for a database connection ({self.size} in use)")
+                    self._lock.wait(remaining)
+
+                if self._idle:
+                    conn, created_at = self._idle.pop()
+                else:
+                    conn, created_at = None, None
+                    self._opened += 1
+                self._in_use += 1
+            finally:
+                self._waiting -= 1
+
+        # Health check and connect outside the lock so other threads are not blocked
+        try:
+            if conn is not None and not self._healthy(conn, created_at):
+                self._close_quietly(conn)
+                with self._lock:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn, created_at = self.factory(), time.monotonic()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn, created_at
+
+    def release(self, conn, created_at, discard=False):
+        """Return a checked out connection to the pool"""
+        if not discard:
+            try:
+                # Never hand an open transaction to the next caller
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._opened -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((conn, created_at))
+            self._lock.notify()
+
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with-block"""
+        conn, created_at = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Error:
+            # Driver errors may leave the connection unusable
+            discard = True
+            raise
+        finally:
+            self.release(conn, created_at, discard=discard)
+
+    def close_all(self):
+        """Close every idle connection (checked out ones are closed on release)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def reset_after_fork(self):
+        """Forget connections inherited from the parent process
+
+        The parent still owns those sockets, so they are dropped without
+        being closed; this process opens its own on demand.
+        """
+        self._lock = threading.Condition()
+        self._idle = []
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+
+    def stats(self):
+        """Return a snapshot of pool usage for sizing"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'checkout_latency_avg_ms': (self._wait_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                'checkout_latency_max_ms': self._wait_max * 1000,
+            }
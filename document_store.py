@@ -0,0 +1,57 @@
+import hashlib
+import zlib
+
+
+def content_hash(text):
+    """SHA-256 of a document's text, used as its identity"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+SELECT_DOCUMENT_ID = "SELECT id FROM documents WHERE content_hash = %s"
+# A concurrent insert of the same text makes this an update that still reports the existing id
+INSERT_DOCUMENT = """
+    INSERT INTO documents (content_hash, text_compressed, text_length) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+"""
+
+
+def document_row(text, digest=None):
+    """(content_hash, text_compressed, text_length) for INSERT_DOCUMENT"""
+    return digest or content_hash(text), zlib.compress(text.encode('utf-8')), len(text)
+
+
+def store_document(cursor, text):
+    """Store text once, compressed, and return its documents.id"""
+    digest = content_hash(text)
+    # Look up first so text we already hold is never shipped to MySQL again
+    cursor.execute(SELECT_DOCUMENT_ID, (digest,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute(INSERT_DOCUMENT, document_row(text, digest))
+    return cursor.lastrowid
+
+
+def load_document(cursor, document_id):
+    """Return the text of a stored document, or None"""
+    cursor.execute("SELECT text_compressed FROM documents WHERE id = %s", (document_id,))
+    row = cursor.fetchone()
+    return zlib.decompress(row[0]).decode('utf-8') if row else None
+
+
+class LazyDocument:
+    """Reference to a stored document whose text is only fetched when asked for"""
+
+    def __init__(self, document_id, connect):
+        self.id = document_id
+        self._connect = connect  # Callable returning a pooled-connection context manager
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None and self.id is not None:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                self._text = load_document(cursor, self.id)
+                cursor.close()
+        return self._text
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+CHUNK_SIZE = 64 * 1024
+
+
+def hash_file(file_path):
+    """SHA-256 of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Extracted text keyed by file content hash, in memory and on disk
+
+    The in-memory tier is an LRU bounded by total characters; the disk tier
+    keeps every extraction so other workers and restarts can reuse it.
+    """
+
+    def __init__(self, folder, version, max_memory_chars=64 * 1024 * 1024):
+        self.folder = folder
+        self.version = version
+        self.max_memory_chars = max_memory_chars
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_chars = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def make_key(self, content_hash, variant=''):
+        """Combine the content hash with the extractor version (and options)"""
+        return hashlib.sha256(f'{content_hash}:{self.version}:{variant}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f'{key}.txt')
+
+    def _remember(self, key, text):
+        with self._lock:
+            if key in self._memory:
+                self._memory_chars -= len(self._memory.pop(key))
+            if len(text) > self.max_memory_chars:
+                return
+            self._memory[key] = text
+            self._memory_chars += len(text)
+            while self._memory_chars > self.max_memory_chars:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_chars -= len(evicted)
+
+    def get(self, key):
+        """Return cached text for a key, or None"""
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return text
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, text)
+        return text
+
+    def put(self, key, text):
+        """Store text in both tiers; the disk write is atomic"""
+        self._remember(key, text)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_chars': self._memory_chars,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,25 @@
+import os
+
+# Run `python main.py migrate` once before starting (or restarting) the workers
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import the app and its heavy modules once in the master; workers share them copy-on-write
+preload_app = True
+wsgi_app = 'main:create_app(preload_modules=True)'
+
+
+def post_fork(server, worker):
+    # Each worker opens its own DB connections and starts its own job and recognizer pools
+    import main
+
+    main.reset_after_fork()
+
+
+def worker_exit(server, worker):
+    # Write any buffered rows before the worker goes away
+    import main
+
+    main.get_write_buffer().close()
@@ -0,0 +1,240 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when the queue already holds its maximum number of pending jobs"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _process_start(pid):
+    """Start time of a process in clock ticks since boot, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesized command name; starttime is field 22
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def owner_token(pid=None):
+    """Identify a process as pid:start time, since pids are reused after a restart"""
+    pid = pid or os.getpid()
+    return f'{pid}:{_process_start(pid)}'
+
+
+def _owner_alive(owner):
+    pid, _, started = str(owner).partition(':')
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    # A bare pid from an older row cannot be told apart from a reused one
+    return _pid_alive(pid) and started == str(_process_start(pid))
+
+
+class MemoryJobStore:
+    """In-process job table; jobs are lost when the process exits"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            # Same fields as a fresh SQLite row, so readers never miss a key
+            self._jobs[job['id']] = dict({'result': None, 'error': None, 'owner': None}, **job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, updated_at=time.time())
+
+    def claim(self, job_id, owner):
+        """Mark a queued job as running; returns False if someone else took it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] != QUEUED:
+                return False
+            job.update(status=RUNNING, owner=owner, updated_at=time.time())
+            return True
+
+    def unfinished(self):
+        return []
+
+
+class SQLiteJobStore:
+    """Job table in a local SQLite file so jobs survive worker restarts"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params TEXT,
+                result TEXT,
+                error TEXT,
+                owner TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread; SQLite serializes writers across processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job['params'] = json.loads(job['params']) if job['params'] else None
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def create(self, job):
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, params, result, error, owner, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job['id'], job['kind'], job['status'], json.dumps(job['params']), None, None, None,
+             job['created_at'], job['updated_at']))
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        self._conn().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id, owner):
+        """Mark a queued job as running; returns False if another worker took it"""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, owner, time.time(), job_id, QUEUED))
+        return cursor.rowcount == 1
+
+    def unfinished(self):
+        """Requeue jobs orphaned by dead workers and return every queued job"""
+        conn = self._conn()
+        for row in conn.execute("SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall():
+            if row['owner'] is None or not _owner_alive(row['owner']):
+                conn.execute("UPDATE jobs SET status = ?, owner = NULL WHERE id = ? AND status = ?",
+                             (QUEUED, row['id'], RUNNING))
+        rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+
+class JobQueue:
+    """Bounded local worker pool that runs registered job kinds"""
+
+    def __init__(self, store, workers=2, max_pending=100):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.handlers = {}
+        self._executor = None
+        self._executor_pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def register(self, kind, handler):
+        """Register a callable that takes the job params as keyword arguments"""
+        self.handlers[kind] = handler
+
+    def _get_executor(self):
+        # Created on first use, and again after a fork since threads do not survive one
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='jobs')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, kind, params):
+        """Persist a new job and schedule it; returns the job id"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"Job queue is full ({self.max_pending} pending)")
+            self._pending += 1
+        now = time.time()
+        job = {'id': uuid.uuid4().hex, 'kind': kind, 'status': QUEUED, 'params': params,
+               'created_at': now, 'updated_at': now}
+        try:
+            self.store.create(job)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._get_executor().submit(self._run, job['id'], kind, params)
+        return job['id']
+
+    def resume(self):
+        """Schedule jobs left queued or interrupted by a previous process"""
+        jobs = self.store.unfinished()
+        for job in jobs:
+            if job['kind'] in self.handlers:
+                with self._lock:
+                    self._pending += 1
+                self._get_executor().submit(self._run, job['id'], job['kind'], job['params'])
+        return len(jobs)
+
+    def _run(self, job_id, kind, params):
+        try:
+            if not self.store.claim(job_id, owner_token()):
+                return
+            try:
+                result = self.handlers[kind](**params)
+                self.store.update(job_id, status=FINISHED, result=result)
+            except Exception as e:
+                print(f"Error running {kind} job {job_id}: {e}")
+                self.store.update(job_id, status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'pending': self._pending, 'max_pending': self.max_pending}
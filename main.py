@@ -1,13 +1,34 @@
-from flask import Flask, request, jsonify, send_file
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import os
-from gtts import gTTS
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import mysql.connector
+import re
+import json
+import argparse
+import importlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 from mysql.connector import Error
-import fitz  # PyMuPDF for PDF processing
-from docx import Document
+from db_pool import ConnectionPool
+from tts_cache import TTSCache
+from speech_synthesis import SpeechSynthesizer
+from jobs import JobQueue, MemoryJobStore, SQLiteJobStore, QueueFull
+from extraction_cache import ExtractionCache, hash_file
+from pdf_extract import PageRangeError, iter_pdf_pages, page_count, parse_page_range
+from migrations import run_migrations
+from document_store import LazyDocument, store_document
+from lru_map import LRUMap
+from audio_responses import send_audio
+from metrics import registry
+from write_behind import WriteBehindBuffer
+from admission import AdmissionController, Overloaded, call_with_retries
+from uploads import Upload, UploadRequest, UploadTooLarge, open_source, path_or_bytes, receive_upload
+from retention import RetentionService, shard_path
+from tokenizer import tokenize
+from passages import matching_passages
+from transcription import (AudioDecodeError, RecognizerPool, RecognizerBusy, SegmentedTranscriber, StubRecognizer,
+                           VoskRecognizer, load_audio, stitch_segments)
 
 # Constants
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
@@ -15,63 +36,253 @@ UPLOAD_FOLDER = 'uploads'
 VOICE_FOLDER = 'voice_messages'
 AUDIO_FOLDER = 'audio_files'
 DOCUMENT_FOLDER = 'documents'
+TTS_CACHE_FOLDER = 'tts_cache'
+CORPUS_FOLDER = 'corpus_index'
+CORPUS_REBUILD_FRACTION = float(os.environ.get('CORPUS_REBUILD_FRACTION', 0.1))  # New documents, relative to the corpus, before IDF is recomputed
+EXTRACTION_CACHE_FOLDER = 'extraction_cache'
+EXTRACTION_CACHE_MEMORY_CHARS = int(os.environ.get('EXTRACTION_CACHE_MEMORY_CHARS', 64 * 1024 * 1024))
+EXTRACTOR_VERSION = 1  # Bump when extract_text output changes to invalidate cached text
+NEAR_DUPLICATE_FOLDER = 'near_duplicates'
+MINHASH_PERMUTATIONS = int(os.environ.get('MINHASH_PERMUTATIONS', 128))
+LSH_BANDS = int(os.environ.get('LSH_BANDS', 32))  # More bands find less similar candidates
+SHINGLE_MODE = os.environ.get('SHINGLE_MODE', 'word')  # 'word' or 'char'
+SHINGLE_SIZE = int(os.environ.get('SHINGLE_SIZE', 3))
+COMPARE_VECTORIZER = os.environ.get('COMPARE_VECTORIZER', 'tfidf')  # 'hashing' keeps memory fixed per comparison
+COMPARE_HASH_FEATURES = int(os.environ.get('COMPARE_HASH_FEATURES', 2 ** 20))  # Columns in hashing mode
+PASSAGE_MIN_WORDS = int(os.environ.get('PASSAGE_MIN_WORDS', 8))  # Shorter shared runs are not reported
+PASSAGE_MAX_RESULTS = int(os.environ.get('PASSAGE_MAX_RESULTS', 200))  # Upper bound for ?max_passages=
+PASSAGE_DEFAULT_RESULTS = int(os.environ.get('PASSAGE_DEFAULT_RESULTS', 50))
+PASSAGE_EXCERPT_CHARS = int(os.environ.get('PASSAGE_EXCERPT_CHARS', 200))  # Text returned per passage
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # Voice files linked from it count against VOICE_QUOTA_BYTES
+TTS_LANG = 'en'  # Change the language as needed
+TTS_CHUNK_CHARS = int(os.environ.get('TTS_CHUNK_CHARS', 1000))  # Max characters per synthesized chunk
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', 4))  # Chunks synthesized concurrently per process
+TTS_CHUNK_RETRIES = int(os.environ.get('TTS_CHUNK_RETRIES', 2))
+TTS_RETRY_DELAY = float(os.environ.get('TTS_RETRY_DELAY', 0.5))  # Base of the jittered exponential backoff
+TTS_MAX_RETRY_DELAY = float(os.environ.get('TTS_MAX_RETRY_DELAY', 10))
+TTS_MAX_CONCURRENT = int(os.environ.get('TTS_MAX_CONCURRENT', 4))  # Documents synthesized at once per process
+TTS_MAX_QUEUE = int(os.environ.get('TTS_MAX_QUEUE', 16))  # Requests allowed to wait for a slot; the rest get 429
+TTS_QUEUE_TIMEOUT = float(os.environ.get('TTS_QUEUE_TIMEOUT', 10))  # Seconds a request may wait for a slot
+TTS_REQUEST_DEADLINE = float(os.environ.get('TTS_REQUEST_DEADLINE', 120))  # Seconds for a whole synthesis, retries included
+BATCH_EXTRACT_WORKERS = int(os.environ.get('BATCH_EXTRACT_WORKERS', 4))  # Parallel extractions per batch
+VOICE_PATH_CACHE_SIZE = int(os.environ.get('VOICE_PATH_CACHE_SIZE', 4096))  # Hot filenames served without a query
+VOICE_LIST_DEFAULT_LIMIT = 100
+VOICE_LIST_MAX_LIMIT = 1000
+STT_BACKEND = os.environ.get('STT_BACKEND', 'vosk')  # 'vosk' (offline model) or 'stub' (tests, benchmarks)
+STT_MODEL_PATH = os.environ.get('STT_MODEL_PATH', 'models/vosk')
+STT_SAMPLE_RATE = 16000
+STT_POOL_SIZE = int(os.environ.get('STT_POOL_SIZE', 2))  # Warm recognizers per process
+STT_POOL_TIMEOUT = float(os.environ.get('STT_POOL_TIMEOUT', 30))  # Seconds to wait for a free recognizer
+STT_STUB_REALTIME_FACTOR = float(os.environ.get('STT_STUB_REALTIME_FACTOR', 0))  # Simulated decode cost for the stub
+STT_WORKERS = int(os.environ.get('STT_WORKERS', os.cpu_count() or 1))  # Processes transcribing segments of long audio
+STT_SEGMENT_SECONDS = float(os.environ.get('STT_SEGMENT_SECONDS', 30))
+STT_SEGMENT_MODE = os.environ.get('STT_SEGMENT_MODE', 'silence')  # 'silence' (cut at pauses) or 'fixed' (overlapping windows)
+STT_SEGMENT_OVERLAP = float(os.environ.get('STT_SEGMENT_OVERLAP', 1.0))  # Seconds shared by adjacent 'fixed' windows
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')  # Buffer hot-path inserts
+WRITE_BEHIND_BATCH = int(os.environ.get('WRITE_BEHIND_BATCH', 200))  # Rows per flush
+WRITE_BEHIND_DELAY = float(os.environ.get('WRITE_BEHIND_DELAY', 0.2))  # Max seconds a row waits before flushing
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 10000))
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'sqlite')  # 'sqlite' survives restarts, 'memory' does not
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # Background jobs run concurrently per process
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 100))
+JOB_ADMISSION_RETRIES = int(os.environ.get('JOB_ADMISSION_RETRIES', 5))  # Background jobs back off instead of failing on 429
+DAY = 24 * 60 * 60
+UPLOAD_QUOTA_BYTES = int(os.environ.get('UPLOAD_QUOTA_BYTES', 1024 ** 3))  # Per folder; 0 disables the quota
+UPLOAD_MAX_AGE = float(os.environ.get('UPLOAD_MAX_AGE', 7 * DAY))  # Seconds since last use; 0 keeps files forever
+DOCUMENT_QUOTA_BYTES = int(os.environ.get('DOCUMENT_QUOTA_BYTES', 1024 ** 3))
+DOCUMENT_MAX_AGE = float(os.environ.get('DOCUMENT_MAX_AGE', 7 * DAY))
+AUDIO_QUOTA_BYTES = int(os.environ.get('AUDIO_QUOTA_BYTES', 4 * 1024 ** 3))
+AUDIO_MAX_AGE = float(os.environ.get('AUDIO_MAX_AGE', 30 * DAY))
+VOICE_QUOTA_BYTES = int(os.environ.get('VOICE_QUOTA_BYTES', 4 * 1024 ** 3))
+VOICE_MAX_AGE = float(os.environ.get('VOICE_MAX_AGE', 30 * DAY))
+RETENTION_MIN_AGE = float(os.environ.get('RETENTION_MIN_AGE', 3600))  # Files this fresh are never evicted for a quota
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 300))  # Seconds between sweeps
+RETENTION_RESCAN_INTERVAL = float(os.environ.get('RETENTION_RESCAN_INTERVAL', 3600))  # Picks up other workers' files
+RETENTION_LOCK_PATH = os.environ.get('RETENTION_LOCK_PATH', 'retention.lock')  # One worker evicts at a time
+
+# Database settings
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'user': os.environ.get('DB_USER', 'root'),  # Your MySQL username
+    'password': os.environ.get('DB_PASSWORD', 'root'),  # Your MySQL password
+    'database': os.environ.get('DB_NAME', 'dylexsia'),
+}
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))  # Per process; size against gunicorn workers x threads
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 3600))  # Seconds before a connection is reopened
+
+# Process-wide services shared by every handler. Each is built on first use, so
+# importing this module opens no connections, starts no threads and writes no
+# files; reset_after_fork() is where a forked worker drops what it inherited.
+_services = {}
+_services_lock = threading.RLock()
+
+def _service(name, build):
+    with _services_lock:
+        if name not in _services:
+            _services[name] = build()
+        return _services[name]
+
+def get_db_pool():
+    """Connection pool shared by every handler"""
+    return _service('db_pool', lambda: ConnectionPool(size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                                                      recycle=DB_POOL_RECYCLE, **DB_CONFIG))
+
+def get_tts_cache():
+    """Synthesized speech keyed by text content"""
+    return _service('tts_cache', lambda: TTSCache(TTS_CACHE_FOLDER, max_bytes=TTS_CACHE_MAX_BYTES))
+
+def get_synthesizer():
+    return _service('synthesizer', lambda: SpeechSynthesizer(
+        TTS_LANG, chunk_chars=TTS_CHUNK_CHARS, workers=TTS_WORKERS, retries=TTS_CHUNK_RETRIES,
+        retry_delay=TTS_RETRY_DELAY, max_retry_delay=TTS_MAX_RETRY_DELAY))
+
+# Bounds calls to the TTS engine so a traffic spike is shed with 429s instead of hitting engine throttling
+tts_admission = AdmissionController('Speech synthesis', limit=TTS_MAX_CONCURRENT, max_queue=TTS_MAX_QUEUE,
+                                    timeout=TTS_QUEUE_TIMEOUT)
+
+# Speech recognizers loaded once per process and shared by every handler
+def create_recognizer():
+    if STT_BACKEND == 'stub':
+        return StubRecognizer(STT_SAMPLE_RATE, realtime_factor=STT_STUB_REALTIME_FACTOR)
+    if STT_BACKEND == 'vosk':
+        return VoskRecognizer(STT_MODEL_PATH, STT_SAMPLE_RATE)
+    raise ValueError(f"Unknown STT_BACKEND: {STT_BACKEND}")
+
+def get_recognizer_pool():
+    return _service('recognizer_pool', lambda: RecognizerPool(create_recognizer, size=STT_POOL_SIZE,
+                                                              timeout=STT_POOL_TIMEOUT))
+
+def get_transcriber():
+    return _service('transcriber', lambda: SegmentedTranscriber(
+        create_recognizer, get_recognizer_pool(), workers=STT_WORKERS, segment_seconds=STT_SEGMENT_SECONDS,
+        mode=STT_SEGMENT_MODE, overlap_seconds=STT_SEGMENT_OVERLAP, sample_rate=STT_SAMPLE_RATE))
+
+# Filename -> path for recently served voice files
+voice_paths = LRUMap(VOICE_PATH_CACHE_SIZE)
+
+def get_extraction_cache():
+    """Extracted text keyed by upload content hash"""
+    return _service('extraction_cache', lambda: ExtractionCache(EXTRACTION_CACHE_FOLDER, EXTRACTOR_VERSION,
+                                                                max_memory_chars=EXTRACTION_CACHE_MEMORY_CHARS))
+
+# Every compared document, searchable with /search; loaded on first use
+# so importing this module does not pull in scipy/sklearn or read the index
+_corpus_index = None
+_near_duplicate_index = None
+_index_lock = threading.RLock()
+
+def get_corpus_index():
+    global _corpus_index
+    with _index_lock:
+        if _corpus_index is None:
+            from corpus_index import CorpusIndex
+
+            _corpus_index = CorpusIndex(CORPUS_FOLDER, rebuild_fraction=CORPUS_REBUILD_FRACTION)
+        return _corpus_index
+
+def get_near_duplicate_index():
+    global _near_duplicate_index
+    with _index_lock:
+        if _near_duplicate_index is None:
+            from near_duplicates import NearDuplicateIndex
+
+            _near_duplicate_index = NearDuplicateIndex(NEAR_DUPLICATE_FOLDER, get_corpus_index(),
+                                                       num_perm=MINHASH_PERMUTATIONS, bands=LSH_BANDS,
+                                                       shingle_mode=SHINGLE_MODE, shingle_size=SHINGLE_SIZE)
+        return _near_duplicate_index
+
+def get_job_queue():
+    """Background jobs for ?async=1 uploads"""
+    def build():
+        store = SQLiteJobStore(JOB_DB_PATH) if JOB_BACKEND == 'sqlite' else MemoryJobStore()
+        return JobQueue(store, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING)
+    return _service('job_queue', build)
+
+# Per-process metrics, exported on /metrics
+REQUEST_SECONDS = registry.histogram('http_request_duration_seconds', 'Time spent handling a request',
+                                     ('endpoint', 'method', 'status'))
+STAGE_SECONDS = registry.histogram('pipeline_stage_duration_seconds', 'Time spent in each pipeline stage', ('stage',))
+DB_SECONDS = registry.histogram('db_connection_hold_seconds',
+                                'Time a pooled connection is checked out, covering its queries and commit')
+UPLOADED_BYTES = registry.counter('uploaded_bytes_total', 'Bytes received in uploads', ('folder',))
+SYNTHESIZED_BYTES = registry.counter('synthesized_audio_bytes_total', 'Bytes of MP3 audio produced by the TTS engine')
+registry.stats_gauges('db_pool', lambda: get_db_pool().stats())
+registry.stats_gauges('tts_cache', lambda: get_tts_cache().stats())
+registry.stats_gauges('extraction_cache', lambda: get_extraction_cache().stats())
+registry.stats_gauges('voice_path_cache', lambda: voice_paths.stats())
+registry.stats_gauges('recognizer_pool', lambda: get_recognizer_pool().stats())
+registry.stats_gauges('job_queue', lambda: get_job_queue().stats())
+registry.stats_gauges('tts_admission', lambda: tts_admission.stats())
 
 # Database connection
+@contextmanager
 def get_db_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",  # Your MySQL username
-        password="root",  # Your MySQL password
-        database="dylexsia"
-    )
-
-# Ensure necessary tables exist
-def create_tables():
-    try:
-        conn = get_db_connection()
+    """Check out a pooled connection; use as a context manager"""
+    with get_db_pool().connection() as conn, DB_SECONDS.time():
+        yield conn
+
+# Inserts nobody reads back in the same request, written in batches when WRITE_BEHIND is on
+def get_write_buffer():
+    return _service('write_buffer', lambda: WriteBehindBuffer(
+        lambda: get_db_connection(), max_batch=WRITE_BEHIND_BATCH, max_delay=WRITE_BEHIND_DELAY,
+        max_pending=WRITE_BEHIND_MAX_PENDING))
+
+registry.stats_gauges('write_behind', lambda: get_write_buffer().stats())
+
+def persist(statement, row):
+    """Run a single-row INSERT now, or queue it for the next batch"""
+    if WRITE_BEHIND:
+        get_write_buffer().add(statement, row)
+        return
+    with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute(statement, row)
+        conn.commit()
+        cursor.close()
 
-        # Create table for storing document comparisons
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS document_comparisons (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                doc1_text TEXT,
-                doc2_text TEXT,
-                similarity_percentage FLOAT
-            )
-        """)
-
-        # Create table for storing voice files
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS voice_files (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                filename VARCHAR(255),
-                file_path VARCHAR(255)
-            )
-        """)
-
-        # Create table for storing transcribed text
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transcribed_text (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                text TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create table for storing Speech-to-Text data
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS speech_to_text (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                audio_file_path VARCHAR(255),
-                transcribed_text TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+# Evicted files take their database references with them
+def forget_voice_files(paths):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("DELETE FROM voice_files WHERE file_path = %s", [(path,) for path in paths])
+        conn.commit()
+        cursor.close()
+    for path in paths:
+        voice_paths.discard(os.path.basename(path))
 
+def forget_audio_files(paths):
+    # The transcript is kept; only the link to the deleted recording goes
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("UPDATE speech_to_text SET audio_file_path = NULL WHERE audio_file_path = %s",
+                           [(path,) for path in paths])
         conn.commit()
         cursor.close()
-        conn.close()
+
+# Quotas and maximum ages for every folder the service writes to, enforced in the background
+def get_retention():
+    def build():
+        retention = RetentionService(interval=RETENTION_INTERVAL, rescan_interval=RETENTION_RESCAN_INTERVAL,
+                                     lock_path=RETENTION_LOCK_PATH)
+        retention.manage(UPLOAD_FOLDER, UPLOAD_QUOTA_BYTES, UPLOAD_MAX_AGE, RETENTION_MIN_AGE)
+        retention.manage(DOCUMENT_FOLDER, DOCUMENT_QUOTA_BYTES, DOCUMENT_MAX_AGE, RETENTION_MIN_AGE)
+        retention.manage(AUDIO_FOLDER, AUDIO_QUOTA_BYTES, AUDIO_MAX_AGE, RETENTION_MIN_AGE,
+                         on_evict=forget_audio_files)
+        retention.manage(VOICE_FOLDER, VOICE_QUOTA_BYTES, VOICE_MAX_AGE, RETENTION_MIN_AGE,
+                         on_evict=forget_voice_files)
+        return retention
+    return _service('retention', build)
+
+for folder in (UPLOAD_FOLDER, DOCUMENT_FOLDER, AUDIO_FOLDER, VOICE_FOLDER):
+    registry.stats_gauges(f'storage_{folder}', lambda folder=folder: get_retention().index(folder).stats())
+
+# Ensure necessary tables exist
+def create_tables():
+    try:
+        with get_db_connection() as conn:
+            run_migrations(conn)
 
     except Error as e:
         print(f"Error creating tables: {e}")
@@ -91,8 +302,11 @@ def create_folders():
 class App:
     def __init__(self, name):
         self.app = Flask(name)
-        # Create tables if they don't exist
-        create_tables()
+        # Hash, size-check and spool uploads while the body is parsed
+        self.app.request_class = UploadRequest
+        # Let nginx/Apache serve file bodies directly when fronted by one
+        self.app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+        # Schema changes run once per deploy through `python main.py migrate`, not per worker
         # Create folders if they don't exist
         create_folders()
         
@@ -101,6 +315,7 @@ class App:
         self.app.add_url_rule('/convert', 'convert_text_to_speech', self.convert_text_to_speech, methods=['POST'])
         self.app.add_url_rule('/voice/<filename>', 'serve_voice', self.serve_voice, methods=['GET'])
         self.app.add_url_rule('/voices', 'get_all_voice_files', self.get_all_voice_files, methods=['GET'])
+        self.app.add_url_rule('/audio/<key>.mp3', 'serve_audio', self.serve_audio, methods=['GET'])
         self.app.add_url_rule('/transcribe', 'transcribe_audio', self.transcribe_audio, methods=['POST'])
         self.app.add_url_rule('/get_transcribed_text', 'get_transcribed_text', self.get_transcribed_text, methods=['GET'])
         self.app.add_url_rule('/delete_transcribed_text', 'delete_transcribed_text', self.delete_transcribed_text, methods=['DELETE'])
@@ -109,9 +324,104 @@ class App:
         # New Speech-to-Text endpoint
         self.app.add_url_rule('/speech_to_text', 'handle_speech_to_text', self.handle_speech_to_text, methods=['GET', 'POST', 'PUT', 'DELETE'])
 
+        # Connection pool stats for sizing against the worker count
+        self.app.add_url_rule('/db_pool_stats', 'get_db_pool_stats', self.get_db_pool_stats, methods=['GET'])
+        self.app.add_url_rule('/tts_cache_stats', 'get_tts_cache_stats', self.get_tts_cache_stats, methods=['GET'])
+        self.app.add_url_rule('/storage_stats', 'get_storage_stats', self.get_storage_stats, methods=['GET'])
+        self.app.add_url_rule('/recognizer_stats', 'get_recognizer_stats', self.get_recognizer_stats, methods=['GET'])
+
+        # Prometheus scrape endpoint and per-request timing
+        self.app.add_url_rule('/metrics', 'get_metrics', self.get_metrics, methods=['GET'])
+        self.app.before_request(self.start_timer)
+        self.app.before_request(self.load_uploads)
+        self.app.after_request(self.record_request)
+        self.app.register_error_handler(UploadTooLarge, self.upload_too_large)
+
+        # Stored comparison results; document text is only loaded on request
+        self.app.add_url_rule('/comparisons/<int:comparison_id>', 'get_comparison', self.get_comparison, methods=['GET'])
+
+        # N-way comparison of many uploads at once
+        self.app.add_url_rule('/compare_batch', 'compare_batch', self.compare_batch, methods=['POST'])
+
+        # Top-k lookup against every stored document
+        self.app.add_url_rule('/search', 'search_documents', self.search_documents, methods=['POST'])
+
+        # Candidate lookup through MinHash/LSH buckets
+        self.app.add_url_rule('/near_duplicates', 'find_near_duplicates', self.find_near_duplicates, methods=['POST'])
+
+        # Background job status
+        self.app.add_url_rule('/jobs/<job_id>', 'get_job', self.get_job, methods=['GET'])
+
+        # Run ?async=1 uploads on the local worker pool, picking up jobs a previous process left behind
+        job_queue = get_job_queue()
+        job_queue.register('compare', self.run_compare)
+        job_queue.register('convert', self.run_convert)
+
     def run(self, debug=True):
         self.app.run(debug=debug, host='0.0.0.0', port=5000)
 
+    # Connection Pool Stats Endpoint
+    def get_db_pool_stats(self):
+        return jsonify(get_db_pool().stats())
+
+    # TTS Cache Stats Endpoint
+    def get_tts_cache_stats(self):
+        return jsonify(get_tts_cache().stats())
+
+    # Storage Stats Endpoint
+    def get_storage_stats(self):
+        return jsonify(get_retention().stats())
+
+    # Metrics Endpoint
+    def get_metrics(self):
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    # Helper to time every request
+    def start_timer(self):
+        g.request_started = time.perf_counter()
+
+    def record_request(self, response):
+        """Observe request latency by route, not by raw path, to keep label cardinality bounded"""
+        started = g.get('request_started')
+        if started is not None:
+            # Streamed bodies are still being sent at this point; this measures time to first byte
+            REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                    request.method, str(response.status_code))
+        return response
+
+    # Recognizer Pool Stats Endpoint
+    def get_recognizer_stats(self):
+        return jsonify(get_recognizer_pool().stats())
+
+    # Job Status Endpoint
+    def get_job(self, job_id):
+        try:
+            job = get_job_queue().get(job_id)
+            if not job:
+                return jsonify({"error": "Job not found"}), 404
+
+            response = {'id': job['id'], 'kind': job['kind'], 'status': job['status'],
+                        'result': job['result'], 'error': job['error']}
+            if job['kind'] == 'convert' and job['result']:
+                response['voice_url'] = f"/voice/{job['result']['filename']}"
+            return jsonify(response)
+
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # Helper to decide whether the client asked for a background job
+    def wants_async(self):
+        return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+    # Helper to queue a background job
+    def submit_job(self, kind, **params):
+        """Queue a job and answer 202 with its id"""
+        try:
+            job_id = get_job_queue().submit(kind, params)
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+
     # Document Comparison Endpoint
     def compare_documents(self):
         try:
@@ -121,39 +431,282 @@ class App:
             if not doc1_file or not doc2_file:
                 return jsonify({'error': 'Both documents must be provided'}), 400
 
-            doc1_path = self.save_file(doc1_file, DOCUMENT_FOLDER)
-            doc2_path = self.save_file(doc2_file, DOCUMENT_FOLDER)
+            pages = request.args.get('pages')  # e.g. 1-10,15; applies to PDF uploads, other formats ignore it
+
+            passages = self.passage_options(request.args)
+            if passages and (passages['min_words'] < 1 or passages['limit'] < 1):
+                return jsonify({'error': 'min_words and max_passages must be positive'}), 400
+
+            doc1 = self.receive(doc1_file, DOCUMENT_FOLDER)
+            doc2 = self.receive(doc2_file, DOCUMENT_FOLDER)
+
+            error = self.page_range_error(pages, (doc1, doc1_file.filename), (doc2, doc2_file.filename))
+            if error:
+                return jsonify({'error': error}), 400
+
+            if self.wants_async():
+                # Jobs outlive the request, so their uploads are kept under unique names
+                return self.submit_job('compare', doc1_path=self.keep_upload(doc1, DOCUMENT_FOLDER), doc1_name=doc1_file.filename,
+                                       doc2_path=self.keep_upload(doc2, DOCUMENT_FOLDER), doc2_name=doc2_file.filename,
+                                       doc1_hash=doc1.content_hash, doc2_hash=doc2.content_hash, pages=pages,
+                                       passages=passages)
+
+            return jsonify(self.run_compare(doc1, doc1_file.filename, doc2, doc2_file.filename,
+                                            doc1.content_hash, doc2.content_hash, pages, passages))
 
-            doc1 = self.extract_text(doc1_path, doc1_file.filename)
-            doc2 = self.extract_text(doc2_path, doc2_file.filename)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    # Helper to read the passage report options
+    def passage_options(self, args):
+        """None unless ?passages=1; otherwise the minimum passage length and result count"""
+        if args.get('passages', '').lower() not in ('1', 'true', 'yes'):
+            return None
+        return {'min_words': args.get('min_words', PASSAGE_MIN_WORDS, type=int),
+                'limit': min(args.get('max_passages', PASSAGE_DEFAULT_RESULTS, type=int), PASSAGE_MAX_RESULTS)}
+
+    # Helper to run a comparison on saved files
+    def run_compare(self, doc1_path, doc1_name, doc2_path, doc2_name, doc1_hash=None, doc2_hash=None, pages=None,
+                    passages=None):
+        """Extract, compare and store two documents, given as saved paths or Uploads"""
+        doc1 = self.extract_text(doc1_path, doc1_name, doc1_hash, pages)
+        doc2 = self.extract_text(doc2_path, doc2_name, doc2_hash, pages)
 
-            similarity_percentage = self.compare_texts(doc1, doc2)
+        similarity_percentage = float(self.compare_texts(doc1, doc2))
 
-            # Save the comparison result to the database
-            conn = get_db_connection()
+        # Keep both documents searchable for later lookups
+        self.index_document(doc1, doc1_name)
+        self.index_document(doc2, doc2_name)
+
+        # Save the comparison result to the database, storing each document's text only once
+        with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO document_comparisons (doc1_text, doc2_text, similarity_percentage) VALUES (%s, %s, %s)",
-                           (doc1, doc2, similarity_percentage))
+            doc1_id = store_document(cursor, doc1)
+            doc2_id = store_document(cursor, doc2)
+            cursor.execute("INSERT INTO document_comparisons (doc1_id, doc2_id, similarity_percentage) VALUES (%s, %s, %s)",
+                           (doc1_id, doc2_id, similarity_percentage))
+            comparison_id = cursor.lastrowid
             conn.commit()
             cursor.close()
-            conn.close()
 
-            return jsonify({'similarity_percentage': similarity_percentage})
+        result = {'similarity_percentage': similarity_percentage, 'comparison_id': comparison_id}
+        if passages:
+            result.update(self.passage_report(doc1, doc2, **passages))
+        return result
+
+    # Helper to list the passages two texts share
+    def passage_report(self, doc1, doc2, min_words=PASSAGE_MIN_WORDS, limit=PASSAGE_DEFAULT_RESULTS):
+        """Matching passages with character offsets into each extracted text, longest first"""
+        with STAGE_SECONDS.time('passages'):
+            matches, total = matching_passages(doc1, doc2, min_words, limit, PASSAGE_EXCERPT_CHARS)
+        return {'passages': matches, 'passage_count': total, 'passages_truncated': total > len(matches)}
+
+    # Stored Comparison Endpoint
+    def get_comparison(self, comparison_id):
+        try:
+            comparison = self.load_comparison(comparison_id)
+            if not comparison:
+                return jsonify({"error": "Comparison not found"}), 404
+
+            response = {'id': comparison['id'], 'similarity_percentage': comparison['similarity_percentage'],
+                        'document1_id': comparison['document1'].id, 'document2_id': comparison['document2'].id}
+            if request.args.get('include_text', '').lower() in ('1', 'true', 'yes'):
+                response['document1_text'] = comparison['document1'].text
+                response['document2_text'] = comparison['document2'].text
+            return jsonify(response)
+
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # Helper to read a stored comparison
+    def load_comparison(self, comparison_id):
+        """Fetch a comparison row; its documents' text is fetched lazily on first access"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, doc1_id, doc2_id, similarity_percentage FROM document_comparisons WHERE id = %s",
+                           (comparison_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        if not row:
+            return None
+        return {'id': row[0], 'similarity_percentage': row[3],
+                'document1': LazyDocument(row[1], get_db_connection),
+                'document2': LazyDocument(row[2], get_db_connection)}
+
+    # Batch Comparison Endpoint
+    def compare_batch(self):
+        try:
+            files = [file for file in request.files.getlist('documents') if file.filename]
+            if len(files) < 2:
+                return jsonify({'error': 'At least two documents must be provided'}), 400
+
+            for file in files:
+                if not self.allowed_file(file.filename):
+                    return jsonify({'error': f'Unsupported file format: {file.filename}'}), 400
+
+            threshold = request.args.get('threshold', 0.0, type=float)
+            top_k = request.args.get('top_k')
+            if top_k is not None:
+                # A negative value would slice matches off the end instead of failing
+                if not top_k.isdigit() or int(top_k) < 1:
+                    return jsonify({'error': 'top_k must be a positive integer'}), 400
+                top_k = int(top_k)
+
+            names = [file.filename for file in files]
+            uploads = [self.receive(file, DOCUMENT_FOLDER) for file in files]
+            hashes = [upload.content_hash for upload in uploads]
+
+            # Extract every upload concurrently
+            with ThreadPoolExecutor(max_workers=min(BATCH_EXTRACT_WORKERS, len(files))) as executor:
+                texts = list(executor.map(self.extract_text, uploads, names, hashes))
+
+            matrix = self.similarity_matrix(texts)
+
+            # Every unordered pair at or above the threshold
+            rows, cols = np.triu_indices(len(texts), k=1)
+            scores = matrix[rows, cols]
+            keep = scores >= threshold
+            rows, cols, scores = rows[keep], cols[keep], scores[keep]
+            order = np.argsort(-scores)
+            pairs = [{'document1': names[i], 'document2': names[j], 'similarity_percentage': float(score)}
+                     for i, j, score in zip(rows[order], cols[order], scores[order])]
+
+            response = {'documents': names, 'matrix': matrix.tolist(), 'pairs': pairs}
+
+            if top_k:
+                # Most similar other documents for each upload
+                ranked = matrix.copy()
+                np.fill_diagonal(ranked, -1)
+                response['top_k'] = {
+                    names[i]: [{'document': names[j], 'similarity_percentage': float(ranked[i, j])}
+                               for j in np.argsort(-ranked[i])[:top_k] if ranked[i, j] >= threshold]
+                    for i in range(len(names))
+                }
+
+            # Save all comparison results with a single bulk insert
+            if len(rows):
+                with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    document_ids = {}
+                    for i in sorted(set(rows) | set(cols)):
+                        document_ids[i] = store_document(cursor, texts[i])
+                    cursor.executemany("INSERT INTO document_comparisons (doc1_id, doc2_id, similarity_percentage) VALUES (%s, %s, %s)",
+                                       [(document_ids[i], document_ids[j], float(score)) for i, j, score in zip(rows, cols, scores)])
+                    conn.commit()
+                    cursor.close()
+
+            for text, name in zip(texts, names):
+                self.index_document(text, name)
+
+            return jsonify(response)
 
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    # Helper to compare many texts at once
+    def similarity_matrix(self, texts):
+        """Pairwise cosine similarity percentages from a single TF-IDF fit"""
+        with STAGE_SECONDS.time('vectorize'):
+            tfidf_matrix = self.vectorize(texts)
+            # Rows are L2-normalized, so one sparse product gives every cosine
+            return (tfidf_matrix @ tfidf_matrix.T).toarray() * 100
+
+    # Helper to turn texts into TF-IDF rows
+    def vectorize(self, texts):
+        """L2-normalized TF-IDF rows for texts, using the Sinhala-aware tokenizer
+
+        In 'hashing' mode terms are hashed into COMPARE_HASH_FEATURES columns
+        instead of building a vocabulary, so memory stays fixed however many
+        distinct words the documents contain, at the cost of rare collisions.
+        """
+        from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+
+        if COMPARE_VECTORIZER == 'hashing':
+            counts = HashingVectorizer(analyzer=tokenize, n_features=COMPARE_HASH_FEATURES, alternate_sign=False,
+                                       norm=None, dtype=np.float32).transform(texts)
+            return TfidfTransformer().fit_transform(counts)
+        return TfidfVectorizer(analyzer=tokenize).fit_transform(texts)
+
+    # Corpus Search Endpoint
+    def search_documents(self):
+        try:
+            file = request.files.get('document')
+            if not file:
+                return jsonify({'error': 'No document provided'}), 400
+
+            if not self.allowed_file(file.filename):
+                return jsonify({'error': 'Unsupported file format'}), 400
+
+            k = request.args.get('k', 5, type=int)
+            if k < 1:
+                return jsonify({'error': 'k must be positive'}), 400
+
+            upload = self.receive(file, DOCUMENT_FOLDER)
+            text = self.extract_text(upload, file.filename, upload.content_hash)
+
+            corpus_index = get_corpus_index()
+            matches = corpus_index.search(text, k)
+
+            # Optionally keep the upload for future searches (after searching, so it does not match itself)
+            if request.args.get('add', '').lower() in ('1', 'true', 'yes'):
+                self.index_document(text, file.filename)
+
+            return jsonify({'matches': matches, 'corpus_size': len(corpus_index)})
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    # Near-Duplicate Detection Endpoint
+    def find_near_duplicates(self):
+        try:
+            file = request.files.get('document')
+            if not file:
+                return jsonify({'error': 'No document provided'}), 400
+
+            if not self.allowed_file(file.filename):
+                return jsonify({'error': 'Unsupported file format'}), 400
+
+            threshold = request.args.get('threshold', 50.0, type=float)
+            limit = request.args.get('limit', 20, type=int)
+
+            upload = self.receive(file, DOCUMENT_FOLDER)
+            text = self.extract_text(upload, file.filename, upload.content_hash)
+
+            # Exact TF-IDF scores are only computed for documents sharing an LSH bucket
+            near_duplicate_index = get_near_duplicate_index()
+            matches, candidates = near_duplicate_index.query(text, threshold, limit)
+
+            if request.args.get('add', '').lower() in ('1', 'true', 'yes'):
+                self.index_document(text, file.filename)
+
+            return jsonify({'matches': matches, 'candidates': candidates, 'indexed': len(near_duplicate_index)})
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    # Helper to make a document searchable
+    def index_document(self, text, name):
+        """Add a document to the TF-IDF corpus and the near-duplicate index"""
+        # The indexes only serve lookups, so one needing a reindex must not fail a comparison or stop the other
+        for get_index in (get_corpus_index, get_near_duplicate_index):
+            try:
+                get_index().add(text, name)
+            except Exception as e:
+                print(f"Error indexing {name}: {e}")
+
     # Helper for text preprocessing
     def preprocess_text(self, text):
-        """Preprocess text for comparison"""
-        return text.lower()
+        """Preprocess text for comparison: normalized tokens joined by spaces"""
+        return ' '.join(tokenize(text))
 
     # Helper to compare texts
     def compare_texts(self, doc1, doc2):
         """Compare two texts using cosine similarity"""
-        vectorizer = TfidfVectorizer()
-        tfidf_matrix = vectorizer.fit_transform([doc1, doc2])
-        cosine_sim = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        with STAGE_SECONDS.time('vectorize'):
+            tfidf_matrix = self.vectorize([doc1, doc2])
+            cosine_sim = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])
         similarity_percentage = cosine_sim[0][0] * 100
         return similarity_percentage
 
@@ -170,69 +723,285 @@ class App:
             if not self.allowed_file(file.filename):
                 return jsonify({'error': 'Unsupported file format'}), 400
 
-            file_path = self.save_file(file, UPLOAD_FOLDER)
-            input_text = self.extract_text(file_path, file.filename)
+            pages = request.args.get('pages')  # e.g. 1-10,15; PDF uploads only
+            upload = self.receive(file, UPLOAD_FOLDER)
+            content_hash = upload.content_hash
 
-            output_file_path = self.convert_to_speech(input_text, VOICE_FOLDER, os.path.splitext(file.filename)[0])
+            error = self.page_range_error(pages, (upload, file.filename))
+            if error:
+                return jsonify({'error': error}), 400
 
-            # Save voice file info to the database
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO voice_files (filename, file_path) VALUES (%s, %s)",
-                           (os.path.basename(output_file_path), output_file_path))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            if self.wants_async():
+                return self.submit_job('convert', file_path=self.keep_upload(upload, UPLOAD_FOLDER), filename=file.filename,
+                                       content_hash=content_hash, pages=pages)
+
+            base_filename = os.path.splitext(file.filename)[0]
+
+            # Extracted before any audio is sent, so an unreadable or empty document is answered with JSON
+            input_text = self.extract_text(upload, file.filename, content_hash, pages)
+            if not input_text.strip():
+                return jsonify({'error': 'No text found in the document'}), 400
+
+            if self.wants_stream():
+                return self.stream_speech(VOICE_FOLDER, base_filename, input_text)
+
+            output_file_path = self.convert_to_speech(input_text, VOICE_FOLDER, base_filename)
 
             if output_file_path:
-                return send_file(output_file_path, as_attachment=True)
+                self.save_voice_file(output_file_path)
+                response = send_audio(output_file_path, as_attachment=True)
+                # Immutable, content-addressed copy clients can cache forever
+                response.headers['X-Audio-URL'] = f'/audio/{self.speech_key(input_text)}.mp3'
+                return response
             else:
                 return jsonify({'error': 'Failed to generate MP3'}), 500
 
+        except Overloaded as e:
+            return self.overloaded(e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    # Helper to refuse work the engines cannot take right now
+    def overloaded(self, e):
+        """429 with a Retry-After hint, so clients back off instead of piling on"""
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+    # Helper to run a conversion on a saved file
+    def run_convert(self, file_path, filename, content_hash=None, pages=None):
+        """Extract, synthesize and record a saved upload"""
+        input_text = self.extract_text(file_path, filename, content_hash, pages)
+        # Nobody is waiting on a job, so wait out overload with backoff rather than failing it
+        output_file_path = call_with_retries(
+            lambda: self.convert_to_speech(input_text, VOICE_FOLDER, os.path.splitext(filename)[0]),
+            retries=JOB_ADMISSION_RETRIES, base_delay=TTS_QUEUE_TIMEOUT, max_delay=TTS_REQUEST_DEADLINE,
+            retry_on=(Overloaded,))
+        if not output_file_path:
+            raise RuntimeError('Failed to generate MP3')
+        self.save_voice_file(output_file_path)
+        return {'filename': os.path.basename(output_file_path), 'file_path': output_file_path,
+                'audio_url': f'/audio/{self.speech_key(input_text)}.mp3'}
+
+    # Helper to decide whether the client asked for streamed audio
+    def wants_stream(self):
+        """Stream when ?stream=1 is given or audio/mpeg is the preferred Accept type"""
+        if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return True
+        return request.accept_mimetypes.best == 'audio/mpeg'
+
+    # Helper to stream speech while it is being synthesized
+    def stream_speech(self, output_folder, filename, text):
+        """Send MP3 segments with chunked transfer as they become ready
+
+        The first segment is synthesized before the response starts, so an
+        engine that fails outright is still answered with a JSON error.
+        """
+        output_file = shard_path(output_folder, f'{filename}.mp3')
+        key = self.speech_key(text)
+        headers = {
+            'Content-Disposition': f'attachment; filename={os.path.basename(output_file)}',
+            'X-Accel-Buffering': 'no',  # Stop reverse proxies from buffering the stream
+            'X-Audio-URL': f'/audio/{key}.mp3',
+        }
+
+        tts_cache = get_tts_cache()
+        # copy_to is None when another worker evicted the entry after the lookup
+        if tts_cache.get(key) is not None and tts_cache.copy_to(key, output_file) is not None:
+            self.save_voice_file(output_file)
+            response = send_audio(output_file, as_attachment=True)
+            response.headers['X-Audio-URL'] = headers['X-Audio-URL']
+            return response
+
+        # Admit before the response starts so an overloaded engine can still answer 429
+        deadline = time.monotonic() + TTS_REQUEST_DEADLINE
+        slot = tts_admission.acquire(deadline)
+        segments = self.iter_speech(output_file, [text], deadline)
+        try:
+            first = next(segments, b'')
+        except BaseException:
+            slot.release()
+            raise
+
+        def generate():
+            try:
+                yield first
+                yield from segments
+            finally:
+                segments.close()
+                slot.release()
+
+        response = Response(stream_with_context(generate()), mimetype='audio/mpeg', headers=headers)
+        response.call_on_close(slot.release)
+        return response
+
+    # Helper to synthesize speech segment by segment
+    def iter_speech(self, output_file, pieces, deadline=None):
+        """Yield MP3 segments for text pieces, caching and saving the result once complete"""
+        # Tee every segment into the cache so the next request is a hit
+        tts_cache = get_tts_cache()
+        writer = tts_cache.writer()
+        committed = False
+        seen = []
+
+        def collect():
+            for piece in pieces:
+                seen.append(piece)
+                yield piece
+
+        try:
+            for segment in get_synthesizer().iter_segments(collect(), deadline):
+                SYNTHESIZED_BYTES.inc(len(segment))
+                writer.write(segment)
+                yield segment
+            # The cache key is only known once all the text has been seen
+            writer.commit(self.speech_key('\n'.join(seen)))
+            committed = True
+            if tts_cache.copy_to(writer.key, output_file) is not None:
+                self.save_voice_file(output_file)
+        except Exception as e:
+            print(f"Error streaming MP3: {e}")
+            raise
+        finally:
+            # Client disconnects land here too; drop the partial file
+            if not committed:
+                writer.abort()
+
+    # Helper to address synthesized speech by content
+    def speech_key(self, text):
+        """TTS cache key for text with the current language and engine options"""
+        return TTSCache.make_key(text, TTS_LANG, **get_synthesizer().options())
+
+    # Helper to record a generated voice file
+    def save_voice_file(self, output_file_path):
+        """Save voice file info to the database"""
+        filename = os.path.basename(output_file_path)
+        # filename is unique; converting the same name again refreshes the row
+        persist("""
+            INSERT INTO voice_files (filename, file_path) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE file_path = VALUES(file_path), created_at = CURRENT_TIMESTAMP
+        """, (filename, output_file_path))
+        # /voice/<filename> is served from here even before a buffered row is flushed
+        voice_paths.put(filename, output_file_path)
+        get_retention().record(output_file_path)
+
     # Helper to check if file is allowed
     def allowed_file(self, filename):
         """Check if the file has an allowed extension"""
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-    # Helper to save files
-    def save_file(self, file, folder):
-        """Save the uploaded file and return the file path"""
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(folder, filename)
-        file.save(file_path)
+    # Helper to receive uploads
+    def receive(self, file, folder):
+        """Return the hashed, size-checked Upload for a file; folder labels the byte count"""
+        with STAGE_SECONDS.time('save_file'):
+            upload = receive_upload(file)
+        UPLOADED_BYTES.inc(upload.size, folder)
+        return upload
+
+    # Helper to keep an upload past the request
+    def keep_upload(self, upload, folder):
+        """Save an Upload under a unique, sharded name in folder and index it for retention"""
+        file_path = upload.save_as(folder)
+        get_retention().record(file_path)
         return file_path
 
+    # Helper to parse uploads up front
+    def load_uploads(self):
+        """Parse multipart bodies before the view, so an oversized file is answered with 413"""
+        if request.mimetype == 'multipart/form-data':
+            request.files  # First access streams the body into Uploads
+
+    def upload_too_large(self, e):
+        return jsonify({'error': e.description}), 413
+
     # Helper to extract text from files
-    def extract_text(self, file_path, filename):
-        """Extract text from the uploaded file"""
-        input_text = ""
+    def extract_text(self, source, filename, content_hash=None, pages=None):
+        """Extract text from a saved path or an Upload, reusing earlier extractions of the same content"""
+        with STAGE_SECONDS.time('extract_text'):
+            return '\n'.join(self.iter_extracted(source, filename, content_hash, pages))
+
+    # Helper to build the extraction cache key
+    def extraction_key(self, filename, content_hash, pages=None):
+        extension = os.path.splitext(filename)[1].lower()
+        # Page ranges only apply to PDFs
+        variant = f"{extension}:{pages.replace(' ', '')}" if pages and extension == '.pdf' else extension
+        return get_extraction_cache().make_key(content_hash, variant)
+
+    # Helper to extract text incrementally
+    def iter_extracted(self, source, filename, content_hash=None, pages=None):
+        """Yield the text of the uploaded file piece by piece (PDF pages as they are parsed)"""
+        if content_hash is None:
+            content_hash = source.content_hash if isinstance(source, Upload) else hash_file(source)
+        key = self.extraction_key(filename, content_hash, pages)
+        extraction_cache = get_extraction_cache()
+        cached = extraction_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        extracted = []
+        for piece in self.iter_text(source, filename, pages):
+            extracted.append(piece)
+            yield piece
+        # Only complete extractions are cached
+        extraction_cache.put(key, '\n'.join(extracted))
+
+    # Helper to validate ?pages= before any extraction or job starts
+    def page_range_error(self, pages, *documents):
+        """Why pages cannot apply to the (source, filename) documents, or None if it can"""
+        if not pages:
+            return None
+        pdfs = [source for source, filename in documents if filename.endswith('.pdf')]
+        if not pdfs:
+            return 'pages applies only to PDF uploads'
+        try:
+            for source in pdfs:
+                parse_page_range(pages, page_count(path_or_bytes(source)))
+        except PageRangeError as e:
+            return str(e)
+        return None
+
+    # Helper to parse text out of files
+    def iter_text(self, source, filename, pages=None):
+        """Parse text from a saved path or an Upload, yielding PDF pages one by one"""
         if filename.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                input_text = f.read()
+            with open_source(source) as f:
+                yield f.read().decode('utf-8')
         elif filename.endswith('.pdf'):
-            pdf_text = []
-            with fitz.open(file_path) as pdf:
-                for page in pdf:
-                    pdf_text.append(page.get_text())
-            input_text = '\n'.join(pdf_text)
+            # Large PDFs on disk are sharded by page range across processes
+            yield from iter_pdf_pages(path_or_bytes(source), pages)
         elif filename.endswith('.docx'):
-            doc = Document(file_path)
-            input_text = '\n'.join(paragraph.text for paragraph in doc.paragraphs)
-        return input_text
+            from docx import Document
+
+            with open_source(source) as f:
+                doc = Document(f)
+            yield '\n'.join(paragraph.text for paragraph in doc.paragraphs)
 
     # Helper to convert text to speech
     def convert_to_speech(self, text, output_folder, filename):
         """Convert text to speech and save as an MP3 file"""
         try:
-            tts = gTTS(text=text, lang='en')  # Change the language as needed
-            output_file = os.path.join(output_folder, f'{filename}.mp3')
-            tts.save(output_file)
-            return output_file
+            output_file = shard_path(output_folder, f'{filename}.mp3')
+            key = self.speech_key(text)
+            tts_cache = get_tts_cache()
+            if tts_cache.get(key) is not None:
+                saved = tts_cache.copy_to(key, output_file)
+                if saved is not None:
+                    return saved
+                # Evicted by another worker since the lookup, so synthesize it again
+            # Only synthesize text we have not converted before
+            deadline = time.monotonic() + TTS_REQUEST_DEADLINE
+            with tts_admission.acquire(deadline), STAGE_SECONDS.time('synthesize'):
+                audio = get_synthesizer().synthesize(text, deadline)
+            SYNTHESIZED_BYTES.inc(len(audio))
+            tts_cache.put(key, audio)
+            saved = tts_cache.copy_to(key, output_file)
+            if saved is None:
+                # Evicted again before it could be linked; the bytes are still in hand
+                with open(output_file, 'wb') as f:
+                    f.write(audio)
+                saved = output_file
+            return saved
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error generating MP3: {e}")
             return None
@@ -240,28 +1009,74 @@ class App:
     # Serve Voice File Endpoint
     def serve_voice(self, filename):
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT file_path FROM voice_files WHERE filename = %s", (filename,))
-            file_path = cursor.fetchone()
+            file_path = self.lookup_voice_file(filename)
 
-            if file_path:
-                return send_file(file_path[0])
+            if file_path and os.path.exists(file_path):
+                get_retention().touch(file_path)
+                return send_audio(file_path)
             else:
+                # Deleted or never generated; do not keep serving a stale mapping
+                voice_paths.discard(filename)
                 return jsonify({"error": "File not found"}), 404
 
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    # Helper to resolve a voice filename to its path
+    def lookup_voice_file(self, filename):
+        """Return the stored path for a voice file, skipping the database for hot files"""
+        file_path = voice_paths.get(filename)
+        if file_path is None:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT file_path FROM voice_files WHERE filename = %s", (filename,))
+                row = cursor.fetchone()
+                cursor.close()
+            if row:
+                file_path = row[0]
+                voice_paths.put(filename, file_path)
+        return file_path
+
+    # Serve Content-Addressed Audio Endpoint
+    def serve_audio(self, key):
+        try:
+            if not re.fullmatch(r'[0-9a-f]{64}', key):
+                return jsonify({"error": "File not found"}), 404
+
+            file_path = get_tts_cache().path_for(key)
+            if not os.path.exists(file_path):
+                return jsonify({"error": "File not found"}), 404
+
+            # The key is a hash of the text and engine options, so this URL never changes content
+            return send_audio(file_path, immutable=True)
+
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
     # Get All Voice Files Endpoint
     def get_all_voice_files(self):
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT filename, file_path FROM voice_files")
-            files = cursor.fetchall()
-
-            return jsonify({'files': [{'filename': file[0], 'file_path': file[1]} for file in files]})
+            limit = request.args.get('limit', VOICE_LIST_DEFAULT_LIMIT, type=int)
+            after = request.args.get('after', 0, type=int)  # id of the last file on the previous page
+            if limit < 1:
+                return jsonify({"error": "limit must be positive"}), 400
+            limit = min(limit, VOICE_LIST_MAX_LIMIT)
+
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                # Keyset pagination on the primary key; fetch one extra row to know if there is more
+                cursor.execute("SELECT id, filename, file_path, created_at FROM voice_files WHERE id > %s ORDER BY id LIMIT %s",
+                               (after, limit + 1))
+                files = cursor.fetchall()
+                cursor.close()
+
+            has_more = len(files) > limit
+            files = files[:limit]
+            return jsonify({
+                'files': [{'id': file[0], 'filename': file[1], 'file_path': file[2],
+                           'created_at': str(file[3]) if file[3] else None} for file in files],
+                'next_after': files[-1][0] if has_more else None,
+            })
 
         except Exception as e:
             return jsonify({"error": str(e)}), 500
@@ -273,32 +1088,40 @@ class App:
             if not file:
                 return jsonify({"error": "No audio file provided"}), 400
 
-            file_path = self.save_file(file, AUDIO_FOLDER)
+            file_path = self.keep_upload(self.receive(file, AUDIO_FOLDER), AUDIO_FOLDER)
             transcribed_text = self.transcribe_audio_file(file_path)
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO transcribed_text (text) VALUES (%s)", (transcribed_text,))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            persist("INSERT INTO transcribed_text (text) VALUES (%s)", (transcribed_text,))
 
             return jsonify({"message": "Audio transcribed successfully", "transcribed_text": transcribed_text})
 
+        except RecognizerBusy as e:
+            return jsonify({"error": str(e)}), 503
+        except AudioDecodeError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     def transcribe_audio_file(self, file_path):
-        # Your transcription logic here
-        return "Transcribed text from audio"
+        """Transcribe an audio file and return the stitched text"""
+        return stitch_segments(self.transcribe_segments(file_path))
+
+    # Helper to transcribe long audio as parallel segments
+    def transcribe_segments(self, file_path):
+        """Transcribe an audio file as timestamped segments"""
+        with STAGE_SECONDS.time('decode_audio'):
+            pcm = load_audio(file_path, STT_SAMPLE_RATE)
+        with STAGE_SECONDS.time('transcribe'):
+            return get_transcriber().transcribe(pcm)
 
     # Get Transcribed Text Endpoint
     def get_transcribed_text(self):
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM transcribed_text ORDER BY created_at DESC LIMIT 1")
-            transcribed_text = cursor.fetchone()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM transcribed_text ORDER BY created_at DESC LIMIT 1")
+                transcribed_text = cursor.fetchone()
+                cursor.close()
 
             if transcribed_text:
                 return jsonify({"id": transcribed_text[0], "text": transcribed_text[1]})
@@ -315,12 +1138,11 @@ class App:
             if not text_id:
                 return jsonify({"error": "No ID provided"}), 400
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM transcribed_text WHERE id = %s", (text_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM transcribed_text WHERE id = %s", (text_id,))
+                conn.commit()
+                cursor.close()
 
             return jsonify({"message": "Text deleted successfully"})
 
@@ -336,12 +1158,11 @@ class App:
             if not text_id or not new_text:
                 return jsonify({"error": "Missing ID or text"}), 400
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE transcribed_text SET text = %s WHERE id = %s", (new_text, text_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE transcribed_text SET text = %s WHERE id = %s", (new_text, text_id))
+                conn.commit()
+                cursor.close()
 
             return jsonify({"message": "Text updated successfully"})
 
@@ -365,32 +1186,41 @@ class App:
             if not file:
                 return jsonify({"error": "No audio file provided"}), 400
 
-            file_path = self.save_file(file, AUDIO_FOLDER)
-            transcribed_text = self.transcribe_audio_file(file_path)
+            file_path = self.keep_upload(self.receive(file, AUDIO_FOLDER), AUDIO_FOLDER)
+            segments = self.transcribe_segments(file_path)
+            transcribed_text = stitch_segments(segments)
+            duration = segments[-1]['end'] if segments else 0.0
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO speech_to_text (audio_file_path, transcribed_text) VALUES (%s, %s)", (file_path, transcribed_text))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            persist("""
+                INSERT INTO speech_to_text (audio_file_path, transcribed_text, segments, duration_seconds)
+                VALUES (%s, %s, %s, %s)
+            """, (file_path, transcribed_text, json.dumps(segments, ensure_ascii=False), duration))
 
-            return jsonify({"message": "Audio transcribed successfully", "transcribed_text": transcribed_text})
+            return jsonify({"message": "Audio transcribed successfully", "transcribed_text": transcribed_text,
+                            "segments": segments, "duration_seconds": duration})
 
+        except RecognizerBusy as e:
+            return jsonify({"error": str(e)}), 503
+        except AudioDecodeError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     def get_speech_to_text(self):
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM speech_to_text ORDER BY created_at DESC LIMIT 1")
-            record = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, audio_file_path, transcribed_text, segments, duration_seconds
+                    FROM speech_to_text ORDER BY created_at DESC LIMIT 1
+                """)
+                record = cursor.fetchone()
+                cursor.close()
 
             if record:
-                return jsonify({"id": record[0], "audio_file_path": record[1], "transcribed_text": record[2]})
+                return jsonify({"id": record[0], "audio_file_path": record[1], "transcribed_text": record[2],
+                                "segments": json.loads(record[3]) if record[3] else None,
+                                "duration_seconds": record[4]})
             else:
                 return jsonify({"error": "No records found"}), 404
 
@@ -405,12 +1235,11 @@ class App:
             if not text_id or not new_text:
                 return jsonify({"error": "Missing ID or transcribed text"}), 400
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE speech_to_text SET transcribed_text = %s WHERE id = %s", (new_text, text_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE speech_to_text SET transcribed_text = %s WHERE id = %s", (new_text, text_id))
+                conn.commit()
+                cursor.close()
 
             return jsonify({"message": "Text updated successfully"})
 
@@ -423,22 +1252,101 @@ class App:
             if not text_id:
                 return jsonify({"error": "No ID provided"}), 400
 
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM speech_to_text WHERE id = %s", (text_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM speech_to_text WHERE id = %s", (text_id,))
+                conn.commit()
+                cursor.close()
 
             return jsonify({"message": "Record deleted successfully"})
 
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+# Modules that are slow to import; loaded up front only when preloading
+HEAVY_MODULES = ('scipy.sparse', 'sklearn.feature_extraction.text', 'sklearn.metrics.pairwise',
+                 'sklearn.preprocessing', 'fitz', 'docx', 'gtts')
+
+def preload():
+    """Import heavy modules and load the indexes in a server's master process
+
+    Forked workers then share these pages copy-on-write instead of each
+    importing them again.
+    """
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+    try:
+        get_near_duplicate_index()
+    except Exception as e:
+        # Workers retry on first use; /search and /near_duplicates report the error until a reindex
+        print(f"Error loading search indexes: {e}")
+
+_worker_pid = None
+
+def start_worker():
+    """Start per-process background work; runs once in each server process"""
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    # Pick up jobs a previous process left behind
+    get_job_queue().resume()
+    # Index the storage folders and start evicting past their quotas
+    get_retention().start()
+    # Load the speech model now rather than on the first /transcribe
+    try:
+        get_recognizer_pool().warm()
+    except Exception as e:
+        print(f"Error loading speech recognizer: {e}")
+
+def reset_after_fork():
+    """Drop state inherited from the master process, then start this worker
+
+    Connections, threads and file locks do not survive a fork, so every
+    service the master built is rebuilt here on first use. The job queue
+    is kept for the handlers App registered on it; it opens its own
+    executor and SQLite connection per process, and the preloaded indexes
+    are shared on purpose.
+    """
+    with _services_lock:
+        job_queue = _services.get('job_queue')
+        _services.clear()
+        if job_queue is not None:
+            _services['job_queue'] = job_queue
+    start_worker()
+
+def create_app(preload_modules=False):
+    """Build the WSGI app without touching the database
+
+    With preload_modules=True (gunicorn --preload) heavy modules are loaded
+    now and background work is left to reset_after_fork in each worker.
+    """
+    if preload_modules:
+        preload()
+    application = App(__name__)
+    if not preload_modules:
+        start_worker()
+    return application.app
+
+_app = None
+
+# Expose the Flask app for WSGI servers like Gunicorn (main:app), built on first access
+def __getattr__(name):
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Run the Flask app
 if __name__ == '__main__':
-    app_instance = App(__name__)  # Create an instance of the App class
-    app_instance.run(debug=True)
-
-# Expose the Flask app for WSGI servers like Gunicorn
-app = App(__name__).app
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Document and speech service')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('serve', help='Apply migrations and run the development server (default)')
+    commands.add_parser('migrate', help='Apply pending database migrations and exit')
+    args = parser.parse_args()
+
+    create_tables()
+    if args.command != 'migrate':
+        create_app().run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
@@ -1,16 +1,61 @@
-from flask import Flask, request, jsonify, send_file, send_from_directory
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify
+from werkzeug.security import safe_join
 import os
-from gtts import gTTS
+import time
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import speech_recognition as sr
-import fitz  # PyMuPDF for PDF text extraction
 from docx import Document
+from tts_cache import TTSCache
+from extraction_cache import ExtractionCache, hash_file
+from pdf_extract import extract_pdf_text
+from audio_responses import send_audio
+from speech_synthesis import SpeechSynthesizer
+from admission import AdmissionController, Overloaded, call_with_retries
+from uploads import Upload, UploadRequest, UploadTooLarge, open_source, path_or_bytes, receive_upload
+from retention import RetentionService, shard_of, shard_path
+from tokenizer import tokenize
 
 # Constants
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
 TRANSCRIBED_TEXT_FILE = "transcribed_text.txt"
+TTS_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_cache')
+TTS_LANG = 'si'  # Sinhala language
+EXTRACTION_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extraction_cache')
+EXTRACTOR_VERSION = 1  # Bump when extract_text output changes to invalidate cached text
+TTS_MAX_CONCURRENT = int(os.environ.get('TTS_MAX_CONCURRENT', 4))  # Documents synthesized at once
+TTS_MAX_QUEUE = int(os.environ.get('TTS_MAX_QUEUE', 16))  # Requests allowed to wait for a slot; the rest get 429
+TTS_QUEUE_TIMEOUT = float(os.environ.get('TTS_QUEUE_TIMEOUT', 10))
+TTS_REQUEST_DEADLINE = float(os.environ.get('TTS_REQUEST_DEADLINE', 120))  # Seconds for a whole synthesis, retries included
+STT_MAX_CONCURRENT = int(os.environ.get('STT_MAX_CONCURRENT', 4))  # Google recognizer calls at once
+STT_MAX_QUEUE = int(os.environ.get('STT_MAX_QUEUE', 16))
+STT_QUEUE_TIMEOUT = float(os.environ.get('STT_QUEUE_TIMEOUT', 10))
+STT_REQUEST_DEADLINE = float(os.environ.get('STT_REQUEST_DEADLINE', 30))
+STT_RETRIES = int(os.environ.get('STT_RETRIES', 2))
+DAY = 24 * 3600
+VOICE_QUOTA_BYTES = int(os.environ.get('VOICE_QUOTA_BYTES', 2 * 1024 ** 3))  # 0 disables the quota
+VOICE_MAX_AGE = int(os.environ.get('VOICE_MAX_AGE', 30 * DAY))  # Seconds since last served; 0 keeps files forever
+AUDIO_QUOTA_BYTES = int(os.environ.get('AUDIO_QUOTA_BYTES', 1024 ** 3))
+AUDIO_MAX_AGE = int(os.environ.get('AUDIO_MAX_AGE', 7 * DAY))
+RETENTION_MIN_AGE = int(os.environ.get('RETENTION_MIN_AGE', 3600))  # Files younger than this survive the quota
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 300))
+
+# Extracted text keyed by upload content hash
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_FOLDER, EXTRACTOR_VERSION)
+
+# Synthesized speech keyed by text content
+tts_cache = TTSCache(TTS_CACHE_FOLDER)
+synthesizer = SpeechSynthesizer(TTS_LANG, chunk_chars=int(os.environ.get('TTS_CHUNK_CHARS', 1000)),
+                                workers=int(os.environ.get('TTS_WORKERS', 4)))
+
+# Bound calls to the external engines so spikes are shed with 429s instead of hitting engine throttling
+tts_admission = AdmissionController('Speech synthesis', limit=TTS_MAX_CONCURRENT, max_queue=TTS_MAX_QUEUE,
+                                    timeout=TTS_QUEUE_TIMEOUT)
+recognizer_admission = AdmissionController('Speech recognition', limit=STT_MAX_CONCURRENT, max_queue=STT_MAX_QUEUE,
+                                           timeout=STT_QUEUE_TIMEOUT)
+
+# Generated and uploaded audio, evicted by age and quota in the background
+retention = RetentionService(interval=RETENTION_INTERVAL)
 
 class DocumentComparison:
     @staticmethod
@@ -20,13 +65,13 @@ class DocumentComparison:
 
     @staticmethod
     def preprocess(text):
-        """Preprocess text for comparison (convert to lowercase)"""
-        return text.lower()
+        """Preprocess text for comparison (normalized Sinhala and English tokens)"""
+        return ' '.join(tokenize(text))
 
     @staticmethod
     def compare(doc1, doc2):
         """Compare two documents based on text similarity"""
-        vectorizer = TfidfVectorizer()
+        vectorizer = TfidfVectorizer(analyzer=tokenize)
         tfidf_matrix = vectorizer.fit_transform([doc1, doc2])
         cosine_sim = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])
         similarity_percentage = cosine_sim[0][0] * 100
@@ -37,29 +82,48 @@ class TextToSpeech:
     def convert_to_speech(text, output_folder, filename):
         """Convert text to speech and save as an MP3 file"""
         try:
-            tts = gTTS(text=text, lang='si')  # Sinhala language
-            output_file = os.path.join(output_folder, f'{filename}.mp3')
-            tts.save(output_file)
-            return output_file
+            output_file = shard_path(output_folder, f'{filename}.mp3')
+            key = TTSCache.make_key(text, TTS_LANG, **synthesizer.options())
+            if tts_cache.get(key) is not None:
+                saved = tts_cache.copy_to(key, output_file)
+                if saved is not None:
+                    return saved
+                # Evicted by another process since the lookup, so synthesize it again
+            deadline = time.monotonic() + TTS_REQUEST_DEADLINE
+            with tts_admission.acquire(deadline):
+                tts_cache.put(key, synthesizer.synthesize(text, deadline))
+            return tts_cache.copy_to(key, output_file)
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error generating MP3: {e}")
             return None
 
     @staticmethod
-    def extract_text(file_path, filename):
-        """Extract text based on file type"""
+    def extract_text(source, filename, content_hash=None):
+        """Extract text from a saved path or an Upload, reusing earlier extractions of the same content"""
+        if content_hash is None:
+            content_hash = source.content_hash if isinstance(source, Upload) else hash_file(source)
+        key = extraction_cache.make_key(content_hash, os.path.splitext(filename)[1].lower())
+        input_text = extraction_cache.get(key)
+        if input_text is None:
+            input_text = TextToSpeech.parse_text(source, filename)
+            extraction_cache.put(key, input_text)
+        return input_text
+
+    @staticmethod
+    def parse_text(source, filename):
+        """Parse text based on file type"""
         input_text = ""
         if filename.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                input_text = f.read()
+            with open_source(source) as f:
+                input_text = f.read().decode('utf-8')
         elif filename.endswith('.pdf'):
-            pdf_text = []
-            with fitz.open(file_path) as pdf:
-                for page in pdf:
-                    pdf_text.append(page.get_text())
-            input_text = '\n'.join(pdf_text)
+            # Large PDFs on disk are sharded by page range across processes
+            input_text = extract_pdf_text(path_or_bytes(source))
         elif filename.endswith('.docx'):
-            doc = Document(file_path)
+            with open_source(source) as f:
+                doc = Document(f)
             input_text = '\n'.join(paragraph.text for paragraph in doc.paragraphs)
         return input_text
 
@@ -76,8 +140,11 @@ class SpeechRecognitionService:
                 print("Recording... Please speak.")
                 audio_data = recognizer.listen(source)
 
-            # Try recognizing the speech
-            text = recognizer.recognize_google(audio_data, language="si-LK")
+            # Try recognizing the speech; throttling and network errors are retried with jittered backoff
+            deadline = time.monotonic() + STT_REQUEST_DEADLINE
+            with recognizer_admission.acquire(deadline):
+                text = call_with_retries(lambda: recognizer.recognize_google(audio_data, language="si-LK"),
+                                         retries=STT_RETRIES, retry_on=(sr.RequestError,), deadline=deadline)
             print("Transcribed Text: ", text)
 
             # Save transcribed text to a file
@@ -85,6 +152,8 @@ class SpeechRecognitionService:
                 file.write(text)
 
             return {"success": True, "transcribed_text": text}, 200
+        except Overloaded:
+            raise
         except sr.UnknownValueError:
             return {"success": False, "error": "Could not understand the audio"}, 400
         except sr.RequestError as e:
@@ -95,26 +164,37 @@ class SpeechRecognitionService:
 class FileService:
     @staticmethod
     def save_file(file, upload_folder):
-        """Save the uploaded file"""
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(upload_folder, filename)
-        file.save(file_path)
+        """Save the uploaded file under a unique name and return its path"""
+        file_path = receive_upload(file).save_as(upload_folder)
+        retention.record(file_path)
         return file_path
 
     @staticmethod
-    def get_all_files(folder):
-        """Retrieve all files in the folder"""
-        if not os.path.exists(folder):
+    def get_all_files(index):
+        """Retrieve all files in an indexed folder, most recently used first"""
+        if not os.path.exists(index.folder):
             return [], "Folder does not exist"
-        files = [f for f in os.listdir(folder) if f.endswith('.mp3')]
+        # Served from the in-memory index instead of listing every shard directory
+        files = [os.path.basename(path) for path in index.paths('.mp3')]
         return files, "No files found" if not files else ""
 
 # Flask Application
 class App:
     def __init__(self, name):
         self.app = Flask(name)
+        # Hash, size-check and spool uploads while the body is parsed
+        self.app.request_class = UploadRequest
+        self.app.before_request(self.load_uploads)
+        self.app.register_error_handler(UploadTooLarge, self.upload_too_large)
+        self.app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+        # Index the storage folders once, then keep them under quota in the background
+        self.voice_folder = os.path.join(self.app.root_path, 'voice_messages')
+        self.audio_folder = os.path.join(self.app.root_path, 'audio_uploads')
+        self.voices = retention.manage(self.voice_folder, VOICE_QUOTA_BYTES, VOICE_MAX_AGE, RETENTION_MIN_AGE)
+        retention.manage(self.audio_folder, AUDIO_QUOTA_BYTES, AUDIO_MAX_AGE, RETENTION_MIN_AGE)
+        self.voices.scan()  # /voices is answered from the index, so fill it before serving
+        retention.start()
 
         # Register routes
         self.app.add_url_rule('/compare', 'compare_documents', self.compare_documents, methods=['POST'])
@@ -126,10 +206,21 @@ class App:
         self.app.add_url_rule('/get_transcribed_text', 'get_transcribed_text', self.get_transcribed_text, methods=['GET'])
         self.app.add_url_rule('/delete_transcribed_text', 'delete_transcribed_text', self.delete_transcribed_text, methods=['DELETE'])
         self.app.add_url_rule('/update_transcribed_text', 'update_transcribed_text', self.update_transcribed_text, methods=['PUT'])
+        self.app.add_url_rule('/admission_stats', 'get_admission_stats', self.get_admission_stats, methods=['GET'])
+        self.app.add_url_rule('/storage_stats', 'get_storage_stats', self.get_storage_stats, methods=['GET'])
 
     def run(self, debug=True):
         self.app.run(debug=debug)
 
+    # Helper to parse uploads up front
+    def load_uploads(self):
+        """Parse multipart bodies before the view, so an oversized file is answered with 413"""
+        if request.mimetype == 'multipart/form-data':
+            request.files  # First access streams the body into Uploads
+
+    def upload_too_large(self, e):
+        return jsonify({'error': e.description}), 413
+
     # Document Comparison Endpoint
     def compare_documents(self):
         try:
@@ -139,8 +230,13 @@ class App:
             if not doc1_file or not doc2_file:
                 return jsonify({'error': 'Both documents must be provided'}), 400
 
-            doc1 = doc1_file.read().decode('utf-8')
-            doc2 = doc2_file.read().decode('utf-8')
+            for file in (doc1_file, doc2_file):
+                if not DocumentComparison.allowed_file(file.filename):
+                    return jsonify({'error': f'Unsupported file format: {file.filename}'}), 400
+
+            # Read from the received uploads instead of buffering each body again
+            doc1 = TextToSpeech.extract_text(receive_upload(doc1_file), doc1_file.filename)
+            doc2 = TextToSpeech.extract_text(receive_upload(doc2_file), doc2_file.filename)
 
             doc1 = DocumentComparison.preprocess(doc1)
             doc2 = DocumentComparison.preprocess(doc2)
@@ -165,43 +261,62 @@ class App:
             if not DocumentComparison.allowed_file(file.filename):
                 return jsonify({'error': 'Unsupported file format'}), 400
 
-            upload_folder = os.path.join(self.app.root_path, 'uploads')
-            file_path = FileService.save_file(file, upload_folder)
-
-            input_text = TextToSpeech.extract_text(file_path, file.filename)
-
-            output_folder = os.path.join(self.app.root_path, 'voice_messages')
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
+            upload = receive_upload(file)
+            input_text = TextToSpeech.extract_text(upload, file.filename, upload.content_hash)
 
             base_filename = os.path.splitext(file.filename)[0]
-            output_file_path = TextToSpeech.convert_to_speech(input_text, output_folder, base_filename)
+            output_file_path = TextToSpeech.convert_to_speech(input_text, self.voice_folder, base_filename)
 
             if output_file_path:
-                return send_file(output_file_path, as_attachment=True)
+                retention.record(output_file_path)
+                return send_audio(output_file_path, as_attachment=True)
             else:
                 return jsonify({'error': 'Failed to generate MP3'}), 500
 
+        except Overloaded as e:
+            return self.overloaded(e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
     # Sinhala Speech Recognition Endpoint
     def record_and_convert_sinhala_speech(self):
-        response, status = SpeechRecognitionService.record_and_convert_sinhala_speech()
+        try:
+            response, status = SpeechRecognitionService.record_and_convert_sinhala_speech()
+        except Overloaded as e:
+            return jsonify({"success": False, "error": str(e)}), 429, {'Retry-After': str(e.retry_after)}
         return jsonify(response), status
 
+    # Helper to refuse work the engines cannot take right now
+    def overloaded(self, e):
+        """429 with a Retry-After hint, so clients back off instead of piling on"""
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+    # Queue depth and rejections for both external engines
+    def get_admission_stats(self):
+        return jsonify({'tts': tts_admission.stats(), 'recognizer': recognizer_admission.stats()})
+
+    # Storage usage and evictions per folder
+    def get_storage_stats(self):
+        return jsonify(retention.stats())
+
     # Serve Voice File Endpoint
     def serve_voice(self, filename):
         try:
-            voice_folder = os.path.join(self.app.root_path, 'voice_messages')
-            return send_from_directory(voice_folder, filename)
+            file_path = safe_join(self.voice_folder, shard_of(filename), filename)
+            if file_path is None or not os.path.isfile(file_path):
+                # Files written before sharding sit directly in the folder
+                file_path = safe_join(self.voice_folder, filename)
+            if file_path is None or not os.path.isfile(file_path):
+                return "File not found", 404
+            retention.touch(file_path)
+            # Range requests, strong ETag and conditional GET
+            return send_audio(file_path)
         except Exception as e:
             return str(e), 500
 
     # Retrieve all voice files
     def get_all_voice_files(self):
-        voice_folder = os.path.join(self.app.root_path, 'voice_messages')
-        voice_files, error_msg = FileService.get_all_files(voice_folder)
+        voice_files, error_msg = FileService.get_all_files(self.voices)
         if not voice_files:
             return jsonify({"success": False, "error": error_msg}), 404
         return jsonify({"success": True, "voice_files": voice_files}), 200
@@ -216,11 +331,7 @@ class App:
             if audio_file.filename == '':
                 return jsonify({"success": False, "error": "No selected file"}), 400
 
-            audio_folder = os.path.join(self.app.root_path, 'audio_uploads')
-            if not os.path.exists(audio_folder):
-                os.makedirs(audio_folder)
-
-            audio_path = FileService.save_file(audio_file, audio_folder)
+            audio_path = FileService.save_file(audio_file, self.audio_folder)
 
             with open(TRANSCRIBED_TEXT_FILE, 'w', encoding='utf-8') as file:
                 file.write(f"Audio file received: {audio_file.filename}")
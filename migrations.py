@@ -0,0 +1,175 @@
+import zlib
+
+from document_store import content_hash
+
+MIGRATION_LOCK = 'dylexsia_schema_migrations'
+BATCH_SIZE = 200  # Rows moved per round trip when migrating stored text
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def initial_schema(conn, cursor):
+    """Tables the service started with"""
+    # Create table for storing document comparisons
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_comparisons (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            doc1_text TEXT,
+            doc2_text TEXT,
+            similarity_percentage FLOAT
+        )
+    """)
+
+    # Create table for storing voice files
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS voice_files (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            filename VARCHAR(255),
+            file_path VARCHAR(255)
+        )
+    """)
+
+    # Create table for storing transcribed text
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transcribed_text (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            text TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Create table for storing Speech-to-Text data
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS speech_to_text (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            audio_file_path VARCHAR(255),
+            transcribed_text TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def content_addressed_documents(conn, cursor):
+    """Store each document once, compressed, and reference it from comparisons"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            text_compressed LONGBLOB NOT NULL,
+            text_length INT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY documents_content_hash (content_hash)
+        )
+    """)
+    # DDL is not transactional in MySQL, so every step checks before it runs
+    for column in ('doc1_id', 'doc2_id'):
+        if not column_exists(cursor, 'document_comparisons', column):
+            cursor.execute(f"ALTER TABLE document_comparisons ADD COLUMN {column} INT NULL")
+        if not index_exists(cursor, 'document_comparisons', f'document_comparisons_{column}'):
+            cursor.execute(f"ALTER TABLE document_comparisons ADD INDEX document_comparisons_{column} ({column})")
+
+    if not column_exists(cursor, 'document_comparisons', 'doc1_text'):
+        return
+
+    # Move existing full-text rows into documents in batches
+    while True:
+        cursor.execute("""
+            SELECT id, doc1_text, doc2_text FROM document_comparisons
+            WHERE doc1_id IS NULL OR doc2_id IS NULL
+            LIMIT %s
+        """, (BATCH_SIZE,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for row_id, doc1, doc2 in rows:
+            ids = []
+            for text in (doc1 or '', doc2 or ''):
+                cursor.execute("""
+                    INSERT INTO documents (content_hash, text_compressed, text_length) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+                """, (content_hash(text), zlib.compress(text.encode('utf-8')), len(text)))
+                ids.append(cursor.lastrowid)
+            cursor.execute("UPDATE document_comparisons SET doc1_id = %s, doc2_id = %s WHERE id = %s",
+                           (ids[0], ids[1], row_id))
+        conn.commit()
+
+    cursor.execute("ALTER TABLE document_comparisons DROP COLUMN doc1_text, DROP COLUMN doc2_text")
+
+
+def voice_files_lookup(conn, cursor):
+    """Unique filename index and created_at for paginated listings and O(1) lookups"""
+    if not column_exists(cursor, 'voice_files', 'created_at'):
+        cursor.execute("ALTER TABLE voice_files ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+
+    if not index_exists(cursor, 'voice_files', 'voice_files_filename'):
+        # Re-converted files were inserted again; keep the newest row per filename
+        cursor.execute("""
+            DELETE older FROM voice_files older
+            JOIN voice_files newer ON older.filename = newer.filename AND older.id < newer.id
+        """)
+        conn.commit()
+        cursor.execute("ALTER TABLE voice_files ADD UNIQUE INDEX voice_files_filename (filename)")
+
+
+def speech_to_text_segments(conn, cursor):
+    """Per-segment timestamps and duration for segmented transcriptions"""
+    if not column_exists(cursor, 'speech_to_text', 'segments'):
+        cursor.execute("ALTER TABLE speech_to_text ADD COLUMN segments LONGTEXT NULL")
+    if not column_exists(cursor, 'speech_to_text', 'duration_seconds'):
+        cursor.execute("ALTER TABLE speech_to_text ADD COLUMN duration_seconds FLOAT NULL")
+
+
+# Ordered (version, name, function(conn, cursor)); append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, 'initial schema', initial_schema),
+    (2, 'content-addressed documents', content_addressed_documents),
+    (3, 'voice file lookup index', voice_files_lookup),
+    (4, 'speech-to-text segments', speech_to_text_segments),
+]
+
+
+def run_migrations(conn):
+    """Apply pending migrations in order; returns the versions applied"""
+    cursor = conn.cursor()
+    # Serialize workers that start at the same time
+    cursor.execute("SELECT GET_LOCK(%s, 60)", (MIGRATION_LOCK,))
+    cursor.fetchall()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        newly_applied = []
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"Applying migration {version}: {name}")
+            migrate(conn, cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        cursor.fetchall()
+        cursor.close()
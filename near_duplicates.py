@@ -0,0 +1,330 @@
+import argparse
+import fcntl
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from corpus_index import CorpusIndex
+from document_store import content_hash
+from tokenizer import TOKENIZER_VERSION, tokenize
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_BLOCK = 4096  # Shingles hashed per step, bounds memory for very long documents
+_KEY_BYTES = 64  # Hex SHA-256 document keys
+
+
+def shingles(text, mode='word', size=3):
+    """Return the set of hashed word or character shingles of a text"""
+    if mode == 'char':
+        normalized = ' '.join(text.lower().split())
+        grams = {normalized[i:i + size] for i in range(max(len(normalized) - size + 1, 1))}
+    else:
+        words = tokenize(text)
+        grams = {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+    # crc32 is stable across processes, unlike hash()
+    return np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams if gram),
+                       dtype=np.uint64, count=-1)
+
+
+class MinHasher:
+    """Compute fixed-width MinHash signatures with seeded universal hashing"""
+
+    def __init__(self, num_perm=128, seed=1):
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = generator.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashed_shingles):
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashed_shingles), _BLOCK):
+            block = hashed_shingles[start:start + _BLOCK]
+            permuted = (np.outer(self.a, block) + self.b[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """MinHash signatures with LSH buckets for sub-linear candidate lookup
+
+    Each document is one fixed-width record (key, then signature) appended
+    to a single file under an exclusive lock, so concurrent workers never
+    interleave rows and keys. Like the corpus index, every process reads
+    the new tail of the file before answering, so documents indexed by
+    one worker are visible to all. A reindex writes a new generation to
+    meta.json, and a worker that sees it (or a records file shorter than
+    what it has read) reloads from the start. Candidates found through the
+    buckets are scored exactly with the TF-IDF corpus index.
+    """
+
+    def __init__(self, folder, corpus, num_perm=128, bands=32, shingle_mode='word', shingle_size=3):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.folder = folder
+        self.corpus = corpus
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle_mode = shingle_mode
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm)
+        self.records_path = os.path.join(folder, 'records.bin')
+        self.meta_path = os.path.join(folder, 'meta.json')
+        self.record_size = _KEY_BYTES + num_perm * 4
+
+        self.keys = []
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)  # Grown by doubling
+        self._rows = {}
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        self._offset = 0  # Bytes of the records file already loaded
+        self._generation = None  # Build of the records file loaded so far
+        self._lock = threading.RLock()
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._load()
+
+    def _meta(self):
+        return {'num_perm': self.hasher.num_perm, 'bands': self.bands,
+                'shingle_mode': self.shingle_mode, 'shingle_size': self.shingle_size, 'format': 2,
+                'tokenizer': TOKENIZER_VERSION}
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            self._write_meta()
+        self.refresh()
+
+    def _write_meta(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(self._meta(), generation=uuid.uuid4().hex), f)
+        # Atomic, since every refresh reads it
+        os.replace(tmp_path, self.meta_path)
+
+    def _read_generation(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return self._generation  # Being rebuilt; keep what is loaded until it is back
+        generation = meta.pop('generation', None)
+        if (generation is None or generation != self._generation) and meta != self._meta():
+            raise ValueError(f'{self.folder} was built with different settings; run a reindex')
+        return generation
+
+    def _clear(self):
+        self.keys = []
+        self._signatures = np.empty((0, self.hasher.num_perm), dtype=np.uint32)
+        self._rows = {}
+        self._buckets = [defaultdict(list) for _ in range(self.bands)]
+        self._offset = 0
+
+    def refresh(self):
+        """Load records appended since the last read, by this or any other process"""
+        with self._lock:
+            generation = self._read_generation()
+            size = os.path.getsize(self.records_path) if os.path.exists(self.records_path) else 0
+            if generation != self._generation or size < self._offset:
+                # Rebuilt since the last read; the old offset and rows no longer apply
+                self._clear()
+                self._generation = generation
+            if size == self._offset:
+                return
+            with open(self.records_path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+            # A record still being written is picked up next time
+            count = len(data) // self.record_size
+            for start in range(0, count * self.record_size, self.record_size):
+                key = data[start:start + _KEY_BYTES].decode('ascii')
+                signature = np.frombuffer(data, dtype=np.uint32, count=self.hasher.num_perm, offset=start + _KEY_BYTES)
+                self._add_row(key, signature)
+            self._offset += count * self.record_size
+
+    def _add_row(self, key, signature):
+        # Two workers may index the same document at once; the first record wins
+        if key in self._rows:
+            return
+        row = len(self.keys)
+        if row == len(self._signatures):
+            grown = np.empty((max(2 * row, 64), self.hasher.num_perm), dtype=np.uint32)
+            grown[:row] = self._signatures
+            self._signatures = grown
+        self._signatures[row] = signature
+        self.keys.append(key)
+        self._rows[key] = row
+        self._bucket(row, signature)
+
+    @property
+    def signatures(self):
+        return self._signatures[:len(self.keys)]
+
+    def _band_keys(self, signature):
+        width = self.rows_per_band
+        return [signature[band * width:(band + 1) * width].tobytes() for band in range(self.bands)]
+
+    def _bucket(self, row, signature):
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self._buckets[band][band_key].append(row)
+
+    def signature(self, text):
+        return self.hasher.signature(shingles(text, self.shingle_mode, self.shingle_size))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, text, name=None):
+        """Index a document's signature and make sure the corpus holds its terms"""
+        key = self.corpus.add(text, name)
+        with self._lock:
+            self.refresh()
+            if key in self._rows:
+                return key
+            record = key.encode('ascii') + self.signature(text).tobytes()
+            with open(self.records_path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(record)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            # Other processes may have appended before us; pick their rows up in order
+            self.refresh()
+        return key
+
+    def candidates(self, text):
+        """Rows sharing at least one LSH bucket with the text, plus estimated Jaccard"""
+        signature = self.signature(text)
+        with self._lock:
+            self.refresh()
+            rows = set()
+            for band, band_key in enumerate(self._band_keys(signature)):
+                rows.update(self._buckets[band].get(band_key, ()))
+            rows = sorted(rows)
+            estimates = (self.signatures[rows] == signature).mean(axis=1) if rows else np.empty(0)
+            return [(self.keys[row], float(estimate)) for row, estimate in zip(rows, estimates)]
+
+    def query(self, text, threshold=50.0, limit=20):
+        """Near-duplicates of text with exact TF-IDF scores computed only for LSH candidates"""
+        candidates = dict(self.candidates(text))
+        matches = []
+        for match in self.corpus.similarity(text, list(candidates)):
+            if match['similarity_percentage'] >= threshold:
+                match['estimated_jaccard'] = candidates[match['key']]
+                matches.append(match)
+        matches.sort(key=lambda match: -match['similarity_percentage'])
+        return matches[:limit], len(candidates)
+
+    def reset(self):
+        """Drop every signature so the index can be rebuilt"""
+        with self._lock:
+            # Empty the records before publishing the new generation, so no
+            # process pairs the new generation with old records
+            open(self.records_path, 'wb').close()
+            self._write_meta()
+            self.refresh()
+
+
+def stored_documents(batch_size=200):
+    """Yield (text, name) for every document stored in the database"""
+    from main import get_db_connection
+
+    last_id = 0
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, text_compressed FROM documents WHERE id > %s ORDER BY id LIMIT %s",
+                           (last_id, batch_size))
+            rows = cursor.fetchall()
+            cursor.close()
+        if not rows:
+            return
+        for document_id, compressed in rows:
+            yield zlib.decompress(compressed).decode('utf-8'), f'document-{document_id}'
+        last_id = rows[-1][0]
+
+
+def reindex():
+    """Rebuild the TF-IDF corpus and the near-duplicate index from every stored document"""
+    from main import CORPUS_FOLDER, NEAR_DUPLICATE_FOLDER, get_near_duplicate_index
+
+    # Indexes built with other settings or another tokenizer refuse to load, so clear them first
+    shutil.rmtree(NEAR_DUPLICATE_FOLDER, ignore_errors=True)
+    corpus_log = os.path.join(CORPUS_FOLDER, 'documents.jsonl')
+    if os.path.exists(corpus_log):
+        os.remove(corpus_log)
+    near_duplicate_index = get_near_duplicate_index()
+    started = time.perf_counter()
+    near_duplicate_index.corpus.reset()
+    near_duplicate_index.reset()
+    for text, name in stored_documents():
+        near_duplicate_index.add(text, name)
+    print(f"Indexed {len(near_duplicate_index)} documents in {time.perf_counter() - started:.1f}s")
+
+
+def _mutate(words, rate, generator, vocabulary):
+    return [generator.choice(vocabulary) if generator.random() < rate else word for word in words]
+
+
+def benchmark(docs=2000, words=400, duplicates=100, rate=0.1, threshold=50.0, seed=7):
+    """Compare LSH recall and latency against brute-force TF-IDF on a synthetic corpus"""
+    generator = random.Random(seed)
+    vocabulary = [f'term{i}' for i in range(20000)]
+    originals = [[generator.choice(vocabulary) for _ in range(words)] for _ in range(docs)]
+    folder = tempfile.mkdtemp(prefix='near_dup_bench_')
+    try:
+        corpus = CorpusIndex(os.path.join(folder, 'corpus'))
+        index = NearDuplicateIndex(os.path.join(folder, 'lsh'), corpus)
+        started = time.perf_counter()
+        for i, document in enumerate(originals):
+            index.add(' '.join(document), f'doc{i}')
+        build_seconds = time.perf_counter() - started
+
+        planted = generator.sample(range(docs), duplicates)
+        queries = [(' '.join(_mutate(originals[i], rate, generator, vocabulary)), i) for i in planted]
+
+        def run(search):
+            latencies, found = [], 0
+            for text, source in queries:
+                started = time.perf_counter()
+                keys = search(text)
+                latencies.append(time.perf_counter() - started)
+                found += content_hash(' '.join(originals[source])) in keys
+            latencies.sort()
+            return {'recall': found / len(queries),
+                    'p50_ms': latencies[len(latencies) // 2] * 1000,
+                    'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000}
+
+        brute = run(lambda text: {m['key'] for m in corpus.search(text, docs)
+                                  if m['similarity_percentage'] >= threshold})
+        lsh = run(lambda text: {m['key'] for m in index.query(text, threshold, limit=docs)[0]})
+        return {'docs': docs, 'words_per_doc': words, 'queries': duplicates, 'mutation_rate': rate,
+                'threshold': threshold, 'build_seconds': build_seconds, 'brute_force': brute, 'lsh': lsh}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Near-duplicate index maintenance')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('reindex', help='Rebuild both indexes from the database')
+    bench = commands.add_parser('benchmark', help='Compare recall and latency against brute force')
+    bench.add_argument('--docs', type=int, default=2000)
+    bench.add_argument('--words', type=int, default=400)
+    bench.add_argument('--duplicates', type=int, default=100)
+    bench.add_argument('--rate', type=float, default=0.1, help='Fraction of words changed in each duplicate')
+    bench.add_argument('--threshold', type=float, default=50.0)
+    args = parser.parse_args()
+
+    if args.command == 'reindex':
+        reindex()
+    else:
+        print(json.dumps(benchmark(args.docs, args.words, args.duplicates, args.rate, args.threshold), indent=2))
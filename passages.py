@@ -0,0 +1,143 @@
+import bisect
+
+from tokenizer import token_spans
+
+
+class SuffixAutomaton:
+    """Suffix automaton over a sequence of hashable symbols
+
+    Recognizes every substring of the sequence with at most 2n states,
+    built in O(n). first_end records where each state's substrings first
+    end, which turns a match back into a position in the sequence.
+    """
+
+    def __init__(self, sequence):
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        self.first_end = [-1]
+        last = 0
+        for position, symbol in enumerate(sequence):
+            current = self._new_state(self.length[last] + 1, position)
+            state = last
+            while state != -1 and symbol not in self.next[state]:
+                self.next[state][symbol] = current
+                state = self.link[state]
+            if state == -1:
+                self.link[current] = 0
+            else:
+                target = self.next[state][symbol]
+                if self.length[state] + 1 == self.length[target]:
+                    self.link[current] = target
+                else:
+                    clone = self._new_state(self.length[state] + 1, self.first_end[target], self.next[target])
+                    self.link[clone] = self.link[target]
+                    while state != -1 and self.next[state].get(symbol) == target:
+                        self.next[state][symbol] = clone
+                        state = self.link[state]
+                    self.link[target] = clone
+                    self.link[current] = clone
+            last = current
+
+    def _new_state(self, length, first_end, transitions=None):
+        self.next.append(dict(transitions) if transitions else {})
+        self.link.append(-1)
+        self.length.append(length)
+        self.first_end.append(first_end)
+        return len(self.length) - 1
+
+    def __len__(self):
+        return len(self.length)
+
+    def longest_matches(self, sequence):
+        """For each position of sequence, yield (length, end in this automaton's sequence) of the
+        longest substring ending there that also occurs in the automaton's sequence"""
+        state = length = 0
+        for symbol in sequence:
+            while state and symbol not in self.next[state]:
+                state = self.link[state]
+                length = self.length[state]
+            if symbol in self.next[state]:
+                state = self.next[state][symbol]
+                length += 1
+            else:
+                state = length = 0
+            yield length, self.first_end[state]
+
+
+def common_runs(sequence1, sequence2, min_length):
+    """Common runs of at least min_length as (start1, start2, length), longest first
+
+    One pass over sequence2 against an automaton of sequence1 finds the
+    longest match ending at every position, so the cost is linear in both
+    lengths instead of comparing every pair of passages. Runs overlap in
+    sequence2 after a mismatch (the automaton resumes on a suffix of the
+    last run); each position is kept by the longest run covering it.
+    """
+    automaton = SuffixAutomaton(sequence1)
+    maximal = []  # (end2, length, end1) of runs that cannot be extended, in sequence2 order
+    previous = None
+    for position, (length, end1) in enumerate(automaton.longest_matches(sequence2)):
+        if previous is not None and length != previous[0] + 1 and previous[0] >= min_length:
+            maximal.append((position - 1,) + previous)
+        previous = (length, end1) if length else None
+    if previous is not None and previous[0] >= min_length:
+        maximal.append((len(sequence2) - 1,) + previous)
+
+    # Starts and ends both increase along sequence2, so a run can only
+    # overlap the nearest chosen run on either side
+    chosen = []  # Indexes into maximal, sorted
+    bounds = {}  # index -> (start2, end2) after trimming
+    runs = []
+    for index in sorted(range(len(maximal)), key=lambda index: -maximal[index][1]):
+        end2, length, end1 = maximal[index]
+        start2 = end2 - length + 1
+        at = bisect.bisect(chosen, index)
+        first = max(start2, bounds[chosen[at - 1]][1] + 1) if at else start2
+        last = min(end2, bounds[chosen[at]][0] - 1) if at < len(chosen) else end2
+        if last - first + 1 < min_length:
+            continue
+        chosen.insert(at, index)
+        bounds[index] = (first, last)
+        runs.append((end1 - length + 1 + first - start2, first, last - first + 1))
+    runs.sort(key=lambda run: -run[2])
+    return runs
+
+
+def matching_passages(text1, text2, min_words=8, limit=50, excerpt_chars=200):
+    """Passages of at least min_words words shared by two texts, longest first
+
+    Words are compared after Sinhala-aware normalization, so case,
+    spacing, punctuation and joiner differences do not break a passage.
+    Offsets are character positions in the original texts (end
+    exclusive), and passages never overlap within the longer text.
+    Returns (passages, total) where at most limit passages are included
+    and each excerpt is cut to excerpt_chars.
+    """
+    spans1 = token_spans(text1)
+    spans2 = token_spans(text2)
+    # Words become small ints so automaton transitions hash cheaply
+    ids = {}
+    sequence1 = [ids.setdefault(token, len(ids)) for token, _, _ in spans1]
+    sequence2 = [ids.setdefault(token, len(ids)) for token, _, _ in spans2]
+
+    # The automaton is the memory-heavy side, so build it over the shorter text
+    if len(sequence1) > len(sequence2):
+        runs = [(start1, start2, length) for start2, start1, length in common_runs(sequence2, sequence1, min_words)]
+    else:
+        runs = common_runs(sequence1, sequence2, min_words)
+
+    passages = []
+    for start1, start2, length in runs[:limit]:
+        begin1, end1 = spans1[start1][1], spans1[start1 + length - 1][2]
+        begin2, end2 = spans2[start2][1], spans2[start2 + length - 1][2]
+        text = text1[begin1:end1]
+        passages.append({
+            'document1_start': begin1,
+            'document1_end': end1,
+            'document2_start': begin2,
+            'document2_end': end2,
+            'words': length,
+            'text': text if len(text) <= excerpt_chars else text[:excerpt_chars] + '...',
+        })
+    return passages, len(runs)
@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 1))  # Processes used for large PDFs
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 32))  # Smaller PDFs stay single-process
+PDF_MIN_SHARD_PAGES = 8
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Created lazily, and again after a fork, so each worker owns its pool
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+class PageRangeError(ValueError):
+    """Raised for a malformed page range or one that starts past the end of the document"""
+
+
+_PAGE_PART = re.compile(r'(\d*)\s*-\s*(\d*)|(\d+)')
+
+
+def parse_page_range(spec, page_count):
+    """Turn a 1-based spec like '1-5,8,10-' into sorted 0-based page indexes
+
+    An open or explicit end past the last page is clamped to it, but a
+    part starting past the last page is an error rather than an empty
+    selection.
+    """
+    if not spec:
+        return list(range(page_count))
+    pages = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = _PAGE_PART.fullmatch(part)
+        if not match or part.replace(' ', '') == '-':
+            raise PageRangeError(f"Invalid page range: {part}")
+        if match.group(3):
+            start = end = int(match.group(3))
+        else:
+            start = int(match.group(1)) if match.group(1) else 1
+            end = int(match.group(2)) if match.group(2) else max(page_count, start)
+        if start < 1 or end < start:
+            raise PageRangeError(f"Invalid page range: {part}")
+        if start > page_count:
+            raise PageRangeError(f"Page range {part} starts past the end of the document ({page_count} pages)")
+        pages.update(range(start - 1, min(end, page_count)))
+    if not pages:
+        raise PageRangeError(f"Invalid page range: {spec}")
+    return sorted(pages)
+
+
+def _open(source):
+    """Open a PDF from a path or from bytes already in memory"""
+    import fitz  # PyMuPDF, imported on first use to keep startup fast
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+
+def page_count(source):
+    with _open(source) as pdf:
+        return pdf.page_count
+
+
+def _extract_pages(file_path, pages):
+    """Extract a list of pages; runs inside worker processes"""
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        return [pdf[page].get_text() for page in pages]
+
+
+def _shards(pages, workers):
+    """Split pages into contiguous runs, one or more per worker"""
+    size = max(PDF_MIN_SHARD_PAGES, -(-len(pages) // workers))
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+
+def iter_pdf_pages(source, spec=None, parallel=True):
+    """Yield page text in order, sharding large PDFs on disk across processes
+
+    source is a path or the PDF's bytes; bytes are always parsed in this
+    process since workers would need their own copy.
+    """
+    with _open(source) as pdf:
+        pages = parse_page_range(spec, pdf.page_count)
+        if (not parallel or not isinstance(source, str) or PDF_WORKERS < 2
+                or len(pages) < PDF_PARALLEL_MIN_PAGES):
+            for page in pages:
+                yield pdf[page].get_text()
+            return
+
+    # Submit every shard up front and yield them in order as they finish,
+    # so callers can start on the first pages while later ones are parsed
+    executor = _get_executor()
+    futures = [executor.submit(_extract_pages, source, shard) for shard in _shards(pages, PDF_WORKERS)]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def extract_pdf_text(source, spec=None):
+    """Extract the selected pages of a PDF as one string"""
+    return '\n'.join(iter_pdf_pages(source, spec))
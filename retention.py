@@ -0,0 +1,249 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SHARD_CHARS = 2  # 256 subdirectories per folder
+
+
+def shard_of(name):
+    """Subdirectory for a file name, taken from a hash so names spread evenly"""
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:SHARD_CHARS]
+
+
+def shard_path(folder, name):
+    """folder/<shard>/name, creating the shard directory"""
+    directory = os.path.join(folder, shard_of(name))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+class FolderIndex:
+    """Files under one folder with their sizes, least recently used first
+
+    Kept in memory so listings and quota checks never walk the tree; a
+    periodic scan picks up files written by other processes.
+    """
+
+    def __init__(self, folder, max_bytes=0, max_age=0, min_age=3600, on_evict=None):
+        self.folder = folder
+        self.max_bytes = max_bytes  # 0 means no quota
+        self.max_age = max_age  # Seconds since last use; 0 means keep forever
+        self.min_age = min_age  # Never evict files used more recently than this for the quota
+        self.on_evict = on_evict  # Called with the paths about to be deleted, before deleting them
+        self._entries = OrderedDict()  # path -> (size, last used)
+        self._total = 0
+        self._lock = threading.Lock()
+
+        # Stats
+        self.scanned_at = 0.0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.eviction_failures = 0
+
+    def scan(self):
+        """Rebuild the index from disk, keeping what this process learned meanwhile"""
+        started = time.time()
+        found = {}
+        for directory, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found[path] = (stat.st_size, max(stat.st_mtime, stat.st_atime))
+        with self._lock:
+            for path, (size, last_used) in self._entries.items():
+                if path in found:
+                    found[path] = (found[path][0], max(found[path][1], last_used))
+                elif last_used >= started:
+                    # Added after the walk passed its directory
+                    found[path] = (size, last_used)
+            self._entries = OrderedDict(sorted(found.items(), key=lambda item: item[1][1]))
+            self._total = sum(size for size, _ in self._entries.values())
+            self.scanned_at = time.time()
+
+    def add(self, path):
+        """Record a file that was just written"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous:
+                self._total -= previous[0]
+            self._entries[path] = (size, time.time())
+            self._total += size
+
+    def touch(self, path):
+        """Mark a file as just used so it is evicted last"""
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry:
+                self._entries[path] = (entry[0], time.time())
+
+    def discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry:
+                self._total -= entry[0]
+
+    def paths(self, suffix=''):
+        """Indexed paths ending in suffix, most recently used first"""
+        with self._lock:
+            return [path for path in reversed(self._entries) if path.endswith(suffix)]
+
+    def victims(self, now=None):
+        """Paths to evict: expired by age, then least recently used until under the quota"""
+        now = time.time() if now is None else now
+        selected = []
+        with self._lock:
+            remaining = self._total
+            for path, (size, last_used) in self._entries.items():
+                expired = self.max_age and last_used < now - self.max_age
+                over_quota = self.max_bytes and remaining > self.max_bytes and last_used < now - self.min_age
+                if not (expired or over_quota):
+                    # Entries are in last-use order, so nothing later qualifies either
+                    break
+                selected.append(path)
+                remaining -= size
+        return selected
+
+    def evict(self, now=None):
+        """Delete the current victims; returns how many files were removed"""
+        paths = self.victims(now)
+        if not paths:
+            return 0
+        if self.on_evict is not None:
+            try:
+                # Rows pointing at the files go first, so nothing references a missing file
+                self.on_evict(paths)
+            except Exception as e:
+                self.eviction_failures += 1
+                print(f"Error evicting {len(paths)} files from {self.folder}: {e}")
+                return 0
+        for path in paths:
+            with self._lock:
+                entry = self._entries.pop(path, None)
+                if entry:
+                    self._total -= entry[0]
+                    self.evicted_files += 1
+                    self.evicted_bytes += entry[0]
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(paths)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+                'eviction_failures': self.eviction_failures,
+                'scanned_at': self.scanned_at,
+            }
+
+
+class RetentionService:
+    """Background sweeper enforcing per-folder quotas and maximum ages
+
+    Every process keeps its own indexes (for listings and lookups), but
+    only the process holding lock_path evicts, so several server workers
+    do not delete the same files at once.
+    """
+
+    def __init__(self, interval=300, rescan_interval=3600, lock_path=None):
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        self.lock_path = lock_path
+        self._folders = {}
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+        self._lock_file = None
+        self.sweeps = 0
+
+    def manage(self, folder, max_bytes=0, max_age=0, min_age=3600, on_evict=None):
+        """Index a folder and enforce a quota and maximum age on it"""
+        index = FolderIndex(folder, max_bytes, max_age, min_age, on_evict)
+        self._folders[os.path.normpath(folder)] = index
+        return index
+
+    def index(self, folder):
+        return self._folders[os.path.normpath(folder)]
+
+    def _index_for(self, path):
+        path = os.path.normpath(path)
+        for folder, index in self._folders.items():
+            if path.startswith(folder + os.sep):
+                return index
+        return None
+
+    def record(self, path):
+        """Index a newly written file under any managed folder"""
+        index = self._index_for(path)
+        if index is not None:
+            index.add(path)
+
+    def touch(self, path):
+        index = self._index_for(path)
+        if index is not None:
+            index.touch(path)
+
+    def _is_leader(self):
+        if self.lock_path is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def sweep(self):
+        """Rescan folders that are due, then evict from each; returns the files removed"""
+        removed = 0
+        now = time.time()
+        leader = self._is_leader()
+        for index in list(self._folders.values()):
+            if now - index.scanned_at >= self.rescan_interval:
+                index.scan()
+            if leader:
+                removed += index.evict(now)
+        self.sweeps += 1
+        return removed
+
+    def start(self):
+        """Start sweeping in the background; again after a fork, since threads do not survive one"""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        self._stop = threading.Event()
+        # The lock is held per open file, so a forked child must open its own
+        self._lock_file = None
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping storage: {e}")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {folder: index.stats() for folder, index in self._folders.items()}
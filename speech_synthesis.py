@@ -0,0 +1,114 @@
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from admission import call_with_retries
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n|\r\n\s*\r\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?෴।])\s+')  # Includes Sinhala kunddaliya and danda
+
+
+def _split_long(sentence, max_chars):
+    """Split a sentence longer than max_chars at word boundaries"""
+    pieces = []
+    current = ''
+    for word in sentence.split():
+        while len(word) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(word[:max_chars])
+            word = word[max_chars:]
+        if current and len(current) + 1 + len(word) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f'{current} {word}' if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_text(text, max_chars=1000):
+    """Split text into chunks of at most max_chars at paragraph and sentence boundaries"""
+    chunks = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        current = ''
+        for sentence in _SENTENCE_END.split(paragraph):
+            parts = _split_long(sentence, max_chars) if len(sentence) > max_chars else [sentence]
+            for part in parts:
+                if current and len(current) + 1 + len(part) > max_chars:
+                    chunks.append(current)
+                    current = part
+                else:
+                    current = f'{current} {part}' if current else part
+        # Never join two paragraphs into one chunk so pauses stay natural
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+class SpeechSynthesizer:
+    """Synthesize long text as independent chunks on a bounded thread pool"""
+
+    def __init__(self, lang, chunk_chars=1000, workers=4, retries=2, retry_delay=0.5, max_retry_delay=10.0):
+        self.lang = lang
+        self.chunk_chars = chunk_chars
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay  # Base of the exponential backoff between attempts
+        self.max_retry_delay = max_retry_delay
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+
+    def options(self):
+        """Engine options that change the generated audio, for cache keys"""
+        return {'engine': 'gtts', 'chunk_chars': self.chunk_chars}
+
+    def synthesize_chunk(self, chunk, deadline=None):
+        """Synthesize one chunk, retrying only this chunk on failure"""
+        from gtts import gTTS  # Imported on first use to keep startup fast
+
+        def attempt():
+            buffer = BytesIO()
+            gTTS(text=chunk, lang=self.lang).write_to_fp(buffer)
+            return buffer.getvalue()
+
+        # Jittered backoff so chunks throttled together do not retry together
+        return call_with_retries(attempt, self.retries, self.retry_delay, self.max_retry_delay, deadline=deadline)
+
+    def iter_segments(self, text, deadline=None):
+        """Yield MP3 segments in document order as they finish
+
+        text may also be an iterable of pieces (e.g. pages still being
+        extracted); each piece is chunked as soon as it arrives. Retries
+        stop once time.monotonic() passes deadline.
+        """
+        pieces = [text] if isinstance(text, str) else text
+        chunks = (chunk for piece in pieces for chunk in split_text(piece, self.chunk_chars))
+
+        # Keep at most `workers` chunks of this document in flight so one
+        # long upload does not starve other requests sharing the pool
+        pending = deque()
+        spoken = False
+        try:
+            for chunk in chunks:
+                spoken = True
+                pending.append(self.executor.submit(self.synthesize_chunk, chunk, deadline))
+                if len(pending) >= self.workers:
+                    yield pending.popleft().result()
+            if not spoken:
+                raise ValueError('No text to speak')
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def synthesize(self, text, deadline=None):
+        """Synthesize the whole text and return the joined MP3 bytes"""
+        # MP3 is a frame stream, so segments can be concatenated as-is
+        return b''.join(self.iter_segments(text, deadline))
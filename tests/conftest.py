@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The modules are flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def service(tmp_path_factory):
+    """main.py on the benchmark harness: SQLite database, stub engines, memory job store"""
+    benchmark = pytest.importorskip('benchmark')
+    cwd = os.getcwd()
+    main = benchmark.load_service(str(tmp_path_factory.mktemp('service')), 0.0, 0.0)
+    yield main
+    os.chdir(cwd)
@@ -0,0 +1,42 @@
+import asyncio
+import io
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(service):
+    pytest.importorskip('quart')
+    pytest.importorskip('aiomysql')
+    import asgi
+    return asgi
+
+
+def test_uploads_over_quart_default_limit_are_received_in_one_pass(asgi, service, monkeypatch):
+    from quart.datastructures import FileStorage
+
+    from uploads import Upload
+
+    # Larger than Quart's default 16 MiB MAX_CONTENT_LENGTH, smaller than MAX_UPLOAD_BYTES
+    text = b'word ' * (4 * 1024 * 1024)
+    received, submitted = [], []
+
+    def receive_upload(file):
+        received.append(file.stream)
+        return file.stream
+
+    monkeypatch.setattr(asgi, 'receive_upload', receive_upload)
+    monkeypatch.setattr(service.get_job_queue(), 'submit', lambda kind, params: submitted.append(params) or 'job')
+
+    async def run():
+        client = asgi.async_app.test_client()
+        response = await client.post('/convert?async=1', files={'file': FileStorage(io.BytesIO(text), filename='big.txt')})
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(run())
+    assert status == 202, body
+    # The parser wrote the part into an Upload directly; nothing re-streamed it
+    assert len(received) == 1 and isinstance(received[0], Upload)
+    assert received[0].size == len(text)
+    assert os.path.getsize(submitted[0]['file_path']) == len(text)
@@ -0,0 +1,27 @@
+import io
+
+import pytest
+
+
+def post_batch(service, query):
+    client = service.create_app().test_client()
+    documents = [(io.BytesIO(text), name) for text, name in (
+        (b'the quick brown fox jumps', 'a.txt'),
+        (b'the quick brown dog sleeps', 'b.txt'),
+        (b'the quick red fox jumps', 'c.txt'),
+    )]
+    return client.post(f'/compare_batch{query}', data={'documents': documents})
+
+
+@pytest.mark.parametrize('top_k', ['-1', '0', 'two', '1.5', ''])
+def test_top_k_must_be_a_positive_integer(service, top_k):
+    response = post_batch(service, f'?top_k={top_k}')
+    assert response.status_code == 400
+    assert 'top_k' in response.get_json()['error']
+
+
+def test_top_k_keeps_the_most_similar_documents(service):
+    response = post_batch(service, '?top_k=1')
+    assert response.status_code == 200, response.get_json()
+    top_k = response.get_json()['top_k']
+    assert [match['document'] for match in top_k['a.txt']] == ['c.txt']
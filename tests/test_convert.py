@@ -0,0 +1,37 @@
+import io
+
+import pytest
+
+
+@pytest.fixture
+def client(service):
+    return service.create_app().test_client()
+
+
+def convert(client, text, name='doc.txt'):
+    return client.post('/convert?stream=1', data={'file': (io.BytesIO(text), name)})
+
+
+def test_streams_mp3(client):
+    response = convert(client, b'Streamed speech for the convert test.')
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/mpeg'
+    assert response.get_data().startswith(b'ID3')
+
+
+def test_empty_document_is_a_json_error_before_streaming(client):
+    response = convert(client, b'  \n ')
+    assert response.status_code == 400
+    assert 'No text' in response.get_json()['error']
+
+
+def test_synthesis_failure_is_a_json_error_before_streaming(client, monkeypatch):
+    import benchmark
+
+    def fail(self, fp):
+        raise RuntimeError('engine unavailable')
+
+    monkeypatch.setattr(benchmark.StubTTS, 'write_to_fp', fail)
+    response = convert(client, b'Text the engine never gets to speak.')
+    assert response.status_code == 500
+    assert 'engine unavailable' in response.get_json()['error']
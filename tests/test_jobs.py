@@ -0,0 +1,85 @@
+import io
+import os
+import time
+
+import pytest
+
+from jobs import FAILED, FINISHED, QUEUED, RUNNING, JobQueue, MemoryJobStore, SQLiteJobStore, owner_token
+
+
+def wait_for(queue, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in (FINISHED, FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+
+
+def test_job_round_trip(store):
+    queue = JobQueue(store, workers=1)
+    queue.register('add', lambda a, b: {'sum': a + b})
+    queue.register('fail', lambda: 1 / 0)
+
+    job_id = queue.submit('add', {'a': 1, 'b': 2})
+    # Every backend exposes the same fields before the job has run
+    assert {'result', 'error', 'status'} <= set(queue.get(job_id))
+
+    job = wait_for(queue, job_id)
+    assert job['status'] == FINISHED
+    assert job['result'] == {'sum': 3}
+    assert job['error'] is None
+
+    job = wait_for(queue, queue.submit('fail', {}))
+    assert job['status'] == FAILED
+    assert job['result'] is None
+    assert 'division by zero' in job['error']
+
+
+def test_async_compare_job_status(service):
+    client = service.create_app().test_client()
+    response = client.post('/compare?async=1', data={
+        'document1': (io.BytesIO(b'the quick brown fox jumps'), 'a.txt'),
+        'document2': (io.BytesIO(b'the quick brown dog sleeps'), 'b.txt'),
+    })
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+
+    # Polled while queued or running as well as once finished
+    deadline = time.monotonic() + 10
+    while True:
+        response = client.get(status_url)
+        assert response.status_code == 200, response.get_json()
+        job = response.get_json()
+        if job['status'] in (FINISHED, FAILED) or time.monotonic() > deadline:
+            break
+        time.sleep(0.02)
+    assert job['status'] == FINISHED, job['error']
+    assert 0 < job['result']['similarity_percentage'] < 100
+
+
+def test_orphaned_jobs_are_requeued(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+    now = time.time()
+    owners = {
+        'mine': owner_token(),
+        # The pid is alive, but it belongs to a process started at another time
+        'reused_pid': f'{os.getpid()}:0',
+        'legacy_pid': os.getpid(),
+    }
+    for job_id, owner in owners.items():
+        store.create({'id': job_id, 'kind': 'add', 'status': QUEUED, 'params': {},
+                      'created_at': now, 'updated_at': now})
+        assert store.claim(job_id, owner)
+
+    requeued = {job['id'] for job in store.unfinished()}
+    assert requeued == {'reused_pid', 'legacy_pid'}
+    assert store.get('mine')['status'] == RUNNING
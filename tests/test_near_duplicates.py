@@ -0,0 +1,129 @@
+import io
+import json
+import random
+
+import pytest
+
+import corpus_index
+from corpus_index import CorpusIndex
+from near_duplicates import NearDuplicateIndex
+
+
+def make_index(folder):
+    # Each instance stands in for a separate server worker sharing the folders
+    return NearDuplicateIndex(str(folder / 'lsh'), CorpusIndex(str(folder / 'corpus')))
+
+
+def document(seed, words=300):
+    generator = random.Random(seed)
+    return ' '.join(f'term{generator.randrange(5000)}' for _ in range(words))
+
+
+def test_sees_documents_added_by_other_instances(tmp_path):
+    first, second = make_index(tmp_path), make_index(tmp_path)
+    key = first.add(document(1), 'one.txt')
+
+    matches, candidates = second.query(document(1))
+    assert candidates == 1
+    assert [match['key'] for match in matches] == [key]
+
+
+def test_reload_pairs_keys_with_their_signatures(tmp_path):
+    first, second = make_index(tmp_path), make_index(tmp_path)
+    texts = [document(seed) for seed in range(10)]
+    # Alternate writers, as concurrent workers would
+    keys = [(first if i % 2 else second).add(text) for i, text in enumerate(texts)]
+    # The same document indexed twice keeps a single row
+    first.add(texts[0])
+
+    reloaded = make_index(tmp_path)
+    assert len(reloaded) == len(texts)
+    for key, text in zip(keys, texts):
+        assert dict(reloaded.candidates(text))[key] == 1.0
+
+
+def test_sinhala_word_shingles_keep_whole_words():
+    from near_duplicates import shingles
+
+    # The joiner and vowel signs stay inside the words, so these spellings shingle identically
+    first = shingles('ශ්‍රී ලංකාව සුන්දර රටකි', size=2)
+    second = shingles('ශ්රී ලංකාව සුන්දර රටකි', size=2)
+    assert len(first) == 3
+    assert set(first) == set(second)
+
+
+def test_corpus_from_another_tokenizer_is_refused_until_reindexed(tmp_path, monkeypatch):
+    corpus = CorpusIndex(str(tmp_path))
+    corpus.add(document(1))
+    # A log written before the tokenizer changed
+    monkeypatch.setattr(corpus_index, 'TOKENIZER_VERSION', corpus_index.TOKENIZER_VERSION + 1)
+    with pytest.raises(ValueError, match='reindex'):
+        CorpusIndex(str(tmp_path))
+    with open(corpus.log_path, 'w') as f:
+        f.write(json.dumps({'key': 'k', 'name': None, 'terms': {'term1': 1}}) + '\n')
+    monkeypatch.undo()
+    with pytest.raises(ValueError, match='reindex'):
+        CorpusIndex(str(tmp_path))
+
+
+def test_rebuilt_corpus_is_reloaded_by_other_instances(tmp_path):
+    first, second = CorpusIndex(str(tmp_path)), CorpusIndex(str(tmp_path))
+    for seed in range(3):
+        first.add(document(seed))
+    assert len(second.search(document(0))) == 3
+
+    first.reset()
+    first.add(document(5))
+    assert [match['key'] for match in second.search(document(5))] == first.keys
+
+
+def test_reindex_elsewhere_reloads_instead_of_skipping_records(tmp_path):
+    first, second = make_index(tmp_path), make_index(tmp_path)
+    for seed in range(5):
+        second.add(document(seed))
+    assert len(first) == 0 and len(second) == 5
+
+    # Another process rebuilds the index with fewer documents than this one has read
+    first.reset()
+    key = first.add(document(9))
+    assert dict(second.candidates(document(9))) == {key: 1.0}
+    assert second.keys == [key]
+
+
+def test_changed_settings_are_refused(tmp_path):
+    make_index(tmp_path)
+    with pytest.raises(ValueError, match='reindex'):
+        NearDuplicateIndex(str(tmp_path / 'lsh'), CorpusIndex(str(tmp_path / 'corpus')), bands=16)
+
+
+def test_compare_answers_when_the_index_needs_a_reindex(service, monkeypatch):
+    def broken():
+        raise ValueError('near_duplicates was built with different settings; run a reindex')
+
+    monkeypatch.setattr(service, 'get_near_duplicate_index', broken)
+    response = service.create_app().test_client().post('/compare', data={
+        'document1': (io.BytesIO(b'the quick brown fox jumps'), 'a.txt'),
+        'document2': (io.BytesIO(b'the quick brown dog sleeps'), 'b.txt'),
+    })
+    assert response.status_code == 200, response.get_json()
+    assert 'similarity_percentage' in response.get_json()
+
+
+def test_corpus_adds_do_not_rebuild_the_matrix_every_search(tmp_path):
+    corpus = CorpusIndex(str(tmp_path), rebuild_fraction=0.1)
+    for seed in range(20):
+        corpus.add(document(seed))
+    corpus.search(document(0))
+    assert corpus.rebuilds == 1
+
+    # Under the threshold the new document is searchable without recomputing IDF
+    key = corpus.add(document(100))
+    top = corpus.search(document(100), k=1)[0]
+    assert top['key'] == key and top['similarity_percentage'] > 99
+    assert corpus.similarity(document(100), [key, corpus.keys[0]])[0]['similarity_percentage'] > 99
+    assert corpus.rebuilds == 1
+
+    for seed in range(101, 104):
+        corpus.add(document(seed))
+    corpus.search(document(0))
+    assert corpus.rebuilds == 2
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from pdf_extract import PageRangeError, parse_page_range
+
+
+@pytest.mark.parametrize('spec, expected', [
+    (None, [0, 1, 2, 3, 4]),
+    ('1-2, 4', [0, 1, 3]),
+    ('4-', [3, 4]),
+    ('-2', [0, 1]),
+    ('3-99', [2, 3, 4]),
+    ('5,5', [4]),
+])
+def test_parse_page_range(spec, expected):
+    assert parse_page_range(spec, 5) == expected
+
+
+@pytest.mark.parametrize('spec', ['abc', '1-x', '3-1', '0', '-', ',', '6', '6-', '2,7-9'])
+def test_parse_page_range_rejects(spec):
+    with pytest.raises(PageRangeError):
+        parse_page_range(spec, 5)
+
+
+@pytest.fixture(scope='module')
+def pdf():
+    benchmark = pytest.importorskip('benchmark')
+    pytest.importorskip('fitz')
+    return benchmark.as_pdf('Some text to compare and speak.\n' * 5)
+
+
+@pytest.mark.parametrize('query', ['', '?async=1'])
+def test_invalid_pages_are_rejected_before_any_work(service, pdf, query):
+    client = service.create_app().test_client()
+    separator = '&' if query else '?'
+
+    def compare(spec, first=(pdf, 'a.pdf')):
+        return client.post(f'/compare{query}{separator}pages={spec}', data={
+            'document1': (io.BytesIO(first[0]), first[1]), 'document2': (io.BytesIO(pdf), 'b.pdf')})
+
+    def convert(spec, document=(pdf, 'a.pdf')):
+        return client.post(f'/convert{query}{separator}pages={spec}', data={
+            'file': (io.BytesIO(document[0]), document[1])})
+
+    for request in (compare, convert):
+        assert request('abc').status_code == 400
+        assert request('999').status_code == 400
+    assert convert('1', (b'plain text', 'a.txt')).status_code == 400
+    # A PDF on one side is enough for compare; the text document ignores pages
+    assert compare('1', (b'plain text', 'a.txt')).status_code in (200, 202)
+    assert convert('1').status_code in (200, 202)
@@ -0,0 +1,32 @@
+import os
+import time
+
+from retention import FolderIndex, shard_path
+
+
+def test_evicts_expired_then_least_recently_used(tmp_path):
+    folder = str(tmp_path)
+    paths = []
+    for i, age in enumerate((300, 200, 100, 0)):
+        path = shard_path(folder, f'{i}.bin')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        os.utime(path, (time.time() - age, time.time() - age))
+        paths.append(path)
+
+    index = FolderIndex(folder, max_bytes=20, max_age=250, min_age=50)
+    index.scan()
+    # 0 is past max_age; 1 goes for the quota; 3 is under min_age and 2 keeps the total at the quota
+    assert index.evict() == 2
+    assert [os.path.exists(path) for path in paths] == [False, False, True, True]
+    assert index.stats()['bytes'] == 20
+
+
+def test_shipped_samples_are_outside_managed_folders(service):
+    import benchmark
+
+    # The service runs from the repository root, so its relative folders would resolve there
+    for folder in service.get_retention().stats():
+        managed = os.path.join(benchmark.REPO_DIR, folder) + os.sep
+        assert not (benchmark.SAMPLE_FOLDER + os.sep).startswith(managed), folder
+    assert all(os.path.exists(os.path.join(benchmark.SAMPLE_FOLDER, name)) for name in benchmark.SAMPLES)
@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_main_has_no_side_effects(tmp_path):
+    # Folders, job database, pools and threads are only built by create_app() or on first use
+    code = ("import sys, threading, main; "
+            "assert not main._services, sorted(main._services); "
+            "assert threading.active_count() == 1; "
+            "assert 'sklearn' not in sys.modules")
+    subprocess.run([sys.executable, '-c', code], cwd=str(tmp_path), check=True,
+                   env=dict(os.environ, PYTHONPATH=REPO_DIR))
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,39 @@
+import os
+
+from tts_cache import TTSCache
+
+
+def test_hits_entries_written_by_another_process(tmp_path):
+    # Two instances over one folder stand in for two server workers
+    first, second = TTSCache(str(tmp_path)), TTSCache(str(tmp_path))
+    key = TTSCache.make_key('ආයුබෝවන්', 'si')
+    first.put(key, b'ID3 audio')
+
+    assert second.get(key) == first.path_for(key)
+    assert second.stats()['hits'] == 1
+    assert second.stats()['bytes'] == len(b'ID3 audio')
+
+
+def test_size_bound_covers_every_process(tmp_path):
+    first = TTSCache(str(tmp_path), max_bytes=250, rescan_interval=0)
+    second = TTSCache(str(tmp_path), max_bytes=250, rescan_interval=0)
+    for i in range(3):
+        first.put(f'first{i}', b'x' * 50)
+    for i in range(3):
+        second.put(f'second{i}', b'x' * 50)
+
+    # Each process alone stays under the bound; together they would not
+    on_disk = sum(entry.stat().st_size for entry in tmp_path.iterdir())
+    assert on_disk <= 250
+    assert second.stats()['bytes'] == on_disk
+
+
+def test_copy_of_entry_evicted_by_another_process_is_none(tmp_path):
+    cache = TTSCache(str(tmp_path / 'cache'))
+    cache.put('key', b'ID3 audio')
+    assert cache.get('key') is not None
+    # Another worker evicts it between the lookup and the copy
+    os.remove(cache.path_for('key'))
+
+    assert cache.copy_to('key', str(tmp_path / 'out.mp3')) is None
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,49 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Sinhala letters and their vowel signs (U+0D80-U+0DFF), Latin combining
+# accents and the zero-width joiners used in conjuncts all stay inside a
+# word. sklearn's default \b\w\w+\b treats the signs as separators, which
+# splits almost every Sinhala word apart and drops the pieces.
+_TOKEN = re.compile(r'[\w\u0300-\u036f\u0d80-\u0dff\u200c\u200d]{2,}')
+_ASCII_TOKEN = re.compile(r'[a-z0-9_]{2,}')
+_JOINERS = str.maketrans('', '', '\u200b\u200c\u200d')  # Zero-width space, non-joiner and joiner
+TOKENIZER_VERSION = 1  # Bump when tokens change, so indexes built from them are rebuilt
+NORMALIZE_CACHE_SIZE = 65536  # Distinct tokens kept; word frequencies are skewed, so this covers most text
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_token(token):
+    """NFC-composed, case-folded token without zero-width joiners
+
+    Joiners only change how a conjunct is drawn (ශ්‍රී and ශ්රී are the same
+    word), and NFC makes precomposed and decomposed vowel signs equal.
+    """
+    return unicodedata.normalize('NFC', token.translate(_JOINERS)).casefold()
+
+
+def tokenize(text):
+    """Split Sinhala and English text into normalized tokens of two or more characters"""
+    if text.isascii():
+        # Nothing to normalize, so skip the per-token work
+        return _ASCII_TOKEN.findall(text.lower())
+    tokens = []
+    for token in _TOKEN.findall(text):
+        token = normalize_token(token)
+        if len(token) > 1:
+            tokens.append(token)
+    return tokens
+
+
+def token_spans(text):
+    """Normalized tokens with their (start, end) character offsets in text, as tokenize splits them"""
+    if text.isascii():
+        # lower() keeps ASCII offsets unchanged
+        return [(match.group(), match.start(), match.end()) for match in _ASCII_TOKEN.finditer(text.lower())]
+    spans = []
+    for match in _TOKEN.finditer(text):
+        token = normalize_token(match.group())
+        if len(token) > 1:
+            spans.append((token, match.start(), match.end()))
+    return spans
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+SAMPLE_WIDTH = 2  # Recognizers take 16-bit mono PCM
+FEED_BYTES = 8000  # PCM bytes fed to a recognizer per call
+FRAME_SECONDS = 0.03  # Energy frame used to find pauses
+MAX_OVERLAP_WORDS = 20  # Longest repeated run removed when stitching overlapping windows
+
+
+class RecognizerBusy(Exception):
+    """Raised when no recognizer could be checked out before the timeout"""
+
+
+class AudioDecodeError(ValueError):
+    """Raised when an upload cannot be decoded to PCM"""
+
+
+def load_audio(file_path, sample_rate=16000):
+    """Decode an audio file to 16-bit mono PCM at sample_rate
+
+    WAV files already in that format are read directly; anything else is
+    converted with ffmpeg.
+    """
+    try:
+        with wave.open(file_path, 'rb') as wav:
+            if (wav.getnchannels() == 1 and wav.getsampwidth() == SAMPLE_WIDTH
+                    and wav.getframerate() == sample_rate and wav.getcomptype() == 'NONE'):
+                return wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        pass
+
+    if shutil.which('ffmpeg') is None:
+        raise AudioDecodeError('Unsupported audio format: only 16-bit mono WAV can be read without ffmpeg')
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', file_path,
+         '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        raise AudioDecodeError(f"Could not decode audio: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return result.stdout
+
+
+class VoskRecognizer:
+    """Offline recognizer backed by a local Vosk/Kaldi model
+
+    The model is loaded once per process and shared by every recognizer
+    instance; each instance owns its own decoder state.
+    """
+
+    _models = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_path, sample_rate=16000):
+        from vosk import KaldiRecognizer, SetLogLevel
+
+        SetLogLevel(-1)
+        self.sample_rate = sample_rate
+        self.recognizer = KaldiRecognizer(self.model(model_path), sample_rate)
+
+    @classmethod
+    def model(cls, model_path):
+        with cls._models_lock:
+            if model_path not in cls._models:
+                from vosk import Model
+
+                cls._models[model_path] = Model(model_path)
+            return cls._models[model_path]
+
+    def transcribe(self, pcm):
+        """Transcribe 16-bit mono PCM and return the text"""
+        for start in range(0, len(pcm), FEED_BYTES):
+            self.recognizer.AcceptWaveform(pcm[start:start + FEED_BYTES])
+        # FinalResult also resets the decoder for the next caller
+        return json.loads(self.recognizer.FinalResult()).get('text', '')
+
+
+class StubRecognizer:
+    """Deterministic recognizer for tests and benchmarks; needs no model or network
+
+    Returns a transcript derived from the audio content, optionally sleeping
+    for realtime_factor seconds per second of audio to mimic decoding cost.
+    """
+
+    def __init__(self, sample_rate=16000, realtime_factor=0.0):
+        self.sample_rate = sample_rate
+        self.realtime_factor = realtime_factor
+
+    def transcribe(self, pcm):
+        seconds = len(pcm) / (SAMPLE_WIDTH * self.sample_rate)
+        if self.realtime_factor:
+            time.sleep(seconds * self.realtime_factor)
+        return f'transcript {hashlib.sha256(pcm).hexdigest()[:12]} {seconds:.2f}s'
+
+
+class RecognizerPool:
+    """Bounded pool of warm recognizer instances shared by request threads"""
+
+    def __init__(self, factory, size=2, timeout=30.0):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        # Stats
+        self._transcriptions = 0
+        self._timeouts = 0
+        self._audio_seconds = 0.0
+        self._busy_seconds = 0.0
+
+    def warm(self):
+        """Create every recognizer up front so the first requests skip model loading"""
+        while True:
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                self._idle.put(self.factory())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+    @contextmanager
+    def recognizer(self):
+        """Check out a recognizer; use as a context manager"""
+        try:
+            instance = self._idle.get_nowait()
+        except queue.Empty:
+            instance = None
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    instance = self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    instance = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise RecognizerBusy(f"Timed out waiting for a recognizer ({self.size} in use)")
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def transcribe(self, pcm):
+        """Transcribe PCM audio on a pooled recognizer"""
+        with self.recognizer() as instance:
+            started = time.monotonic()
+            text = instance.transcribe(pcm)
+            with self._lock:
+                self._transcriptions += 1
+                self._audio_seconds += len(pcm) / (SAMPLE_WIDTH * instance.sample_rate)
+                self._busy_seconds += time.monotonic() - started
+            return text
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': self._idle.qsize(),
+                'transcriptions': self._transcriptions,
+                'timeouts': self._timeouts,
+                'audio_seconds': self._audio_seconds,
+                'busy_seconds': self._busy_seconds,
+                'realtime_factor': self._busy_seconds / self._audio_seconds if self._audio_seconds else 0.0,
+            }
+
+
+def split_segments(pcm, sample_rate=16000, segment_seconds=30.0, mode='silence', overlap_seconds=1.0):
+    """Split PCM into (start_byte, end_byte) segments of at most segment_seconds
+
+    'silence' cuts each segment at the quietest frame in its last third,
+    so words are not split and no overlap is needed. 'fixed' uses equal
+    windows that overlap by overlap_seconds; stitch_segments drops the
+    words repeated in the overlap.
+    """
+    samples = len(pcm) // SAMPLE_WIDTH
+    segment = int(segment_seconds * sample_rate)
+    if samples <= segment:
+        return [(0, samples * SAMPLE_WIDTH)] if samples else []
+
+    bounds = []
+    if mode == 'fixed':
+        step = max(segment - int(overlap_seconds * sample_rate), 1)
+        for start in range(0, samples, step):
+            end = min(start + segment, samples)
+            bounds.append((start, end))
+            if end == samples:
+                break
+    else:
+        audio = np.frombuffer(pcm, dtype=np.int16, count=samples).astype(np.float32)
+        frame = max(int(FRAME_SECONDS * sample_rate), 1)
+        energy = np.square(audio[:samples // frame * frame].reshape(-1, frame)).mean(axis=1)
+        start = 0
+        while samples - start > segment:
+            # Quietest frame in the last third of the window
+            low = (start + segment * 2 // 3) // frame
+            high = max((start + segment) // frame, low + 1)
+            quietest = low + int(np.argmin(energy[low:high]))
+            end = min(quietest * frame + frame // 2, start + segment)
+            bounds.append((start, end))
+            start = end
+        bounds.append((start, samples))
+    return [(start * SAMPLE_WIDTH, end * SAMPLE_WIDTH) for start, end in bounds]
+
+
+def stitch_segments(segments):
+    """Join segment transcripts, dropping words repeated across overlapping windows"""
+    words = []
+    for segment in segments:
+        current = segment['text'].split()
+        for size in range(min(len(words), len(current), MAX_OVERLAP_WORDS), 0, -1):
+            if words[-size:] == current[:size]:
+                current = current[size:]
+                break
+        words.extend(current)
+    return ' '.join(words)
+
+
+_worker_recognizer = None
+
+
+def _init_worker(factory):
+    # Each worker process loads its own model once
+    global _worker_recognizer
+    _worker_recognizer = factory()
+
+
+def _transcribe_segment(pcm):
+    return _worker_recognizer.transcribe(pcm)
+
+
+class SegmentedTranscriber:
+    """Transcribe long audio as segments in parallel worker processes
+
+    Audio that fits in one segment goes straight to the in-process
+    recognizer pool; longer audio is split and fanned out across a
+    process pool whose workers each hold a warm recognizer.
+    """
+
+    def __init__(self, factory, pool, workers=2, segment_seconds=30.0, mode='silence',
+                 overlap_seconds=1.0, sample_rate=16000):
+        self.factory = factory
+        self.pool = pool
+        self.workers = workers
+        self.segment_seconds = segment_seconds
+        self.mode = mode
+        self.overlap_seconds = overlap_seconds
+        self.sample_rate = sample_rate
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily, and again after a fork, so each server worker owns its pool
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     initargs=(self.factory,))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def transcribe(self, pcm):
+        """Return [{'start', 'end', 'text'}] for each segment, in order"""
+        bounds = split_segments(pcm, self.sample_rate, self.segment_seconds, self.mode, self.overlap_seconds)
+        if len(bounds) <= 1 or self.workers < 2:
+            texts = [self.pool.transcribe(pcm[start:end]) for start, end in bounds]
+        else:
+            texts = list(self._get_executor().map(_transcribe_segment, [pcm[start:end] for start, end in bounds]))
+        rate = SAMPLE_WIDTH * self.sample_rate
+        return [{'start': round(start / rate, 3), 'end': round(end / rate, 3), 'text': text}
+                for (start, end), text in zip(bounds, texts)]
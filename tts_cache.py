@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Normalize text so trivially different inputs share a cache entry"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+class CacheWriter:
+    """Write a cache entry piece by piece, publishing it atomically"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.folder, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self, key=None):
+        """Move the finished file into place and return its cached path
+
+        A key can be supplied here when it is only known once the whole
+        input has been seen, e.g. text extracted while it was synthesized.
+        """
+        self.file.close()
+        if key is not None:
+            self.key = key
+        path = self.cache.path_for(self.key)
+        os.replace(self.tmp_path, path)
+        self.cache._track(self.key, self.size)
+        return path
+
+    def abort(self):
+        """Discard a partially written entry"""
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class TTSCache:
+    """Persistent, size-bounded LRU cache of synthesized MP3 files
+
+    The folder can be shared by several processes (server workers, main2).
+    Files are the source of truth: a lookup that misses in memory checks
+    the disk, hits refresh the file's mtime, and the index is rebuilt from
+    disk every rescan_interval seconds before evicting, so the size bound
+    and the LRU order cover every process's entries. max_bytes bounds the
+    cache folder only: copy_to() links entries into other folders, and
+    those links keep the audio on disk until they are removed too.
+    """
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024, rescan_interval=60.0):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total = 0
+        self._scanned_at = 0.0
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self._scan()
+
+    def _scan(self):
+        """Rebuild the LRU order from the files on disk, ordered by last use"""
+        found = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith('.mp3'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(found))
+        self._total = sum(self._entries.values())
+        self._scanned_at = time.monotonic()
+
+    @staticmethod
+    def make_key(text, lang, **options):
+        """Hash the normalized text, language and engine options"""
+        payload = json.dumps({'text': normalize_text(text), 'lang': lang, 'options': options},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f'{key}.mp3')
+
+    def get(self, key):
+        """Return the cached MP3 path for a key, or None on a miss"""
+        path = self.path_for(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                # Never written, or removed behind our back (e.g. evicted by another process)
+                if key in self._entries:
+                    self._total -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Committed by another process; adopt it
+                self._entries[key] = size
+                self._total += size
+            self.hits += 1
+            try:
+                os.utime(path)  # Persist recency for other processes and the next restart
+            except OSError:
+                pass
+            return path
+
+    def put(self, key, data):
+        """Atomically store MP3 bytes under a key and return the cached path"""
+        writer = self.writer(key)
+        try:
+            writer.write(data)
+            return writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+    def writer(self, key=None):
+        """Open an incremental writer that becomes visible only on commit"""
+        return CacheWriter(self, key)
+
+    def _track(self, key, size):
+        with self._lock:
+            if time.monotonic() - self._scanned_at >= self.rescan_interval:
+                # Picks up the new file as well as other processes' entries and deletions
+                self._scan()
+                self._evict()
+                return
+            if key in self._entries:
+                self._total -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total += size
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until under the size limit"""
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def copy_to(self, key, destination):
+        """Materialize a cached entry at a destination path; None if it is no longer cached
+
+        Another process can evict the entry between get() and this call, so
+        callers synthesize again on None. The destination is a hard link when
+        the filesystem allows, so evicting the entry frees no space while the
+        link exists; retention on the destination folder is what bounds it.
+        """
+        source = self.path_for(key)
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            try:
+                os.link(source, destination)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # Another filesystem, or links not supported
+                shutil.copyfile(source, destination)
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._entries:
+                    self._total -= self._entries.pop(key)
+            return None
+        return destination
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,175 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import uuid
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+from extraction_cache import CHUNK_SIZE
+from retention import shard_path
+
+UPLOAD_MEMORY_LIMIT = int(os.environ.get('UPLOAD_MEMORY_LIMIT', 1024 * 1024))  # Larger uploads are spooled to disk
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))  # Per file; 0 disables the limit
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR') or tempfile.gettempdir()
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    """Raised while receiving a file larger than the per-file limit"""
+
+    def __init__(self, limit):
+        super().__init__(f"Uploaded file exceeds the {limit} byte limit")
+        self.limit = limit
+
+
+def unique_path(folder, filename):
+    """folder/<shard>/<name>-<random>.<ext>, so concurrent uploads with one name never overwrite each other"""
+    stem, extension = os.path.splitext(secure_filename(filename or '') or 'upload')
+    return shard_path(folder, f'{stem}-{uuid.uuid4().hex[:12]}{extension}')
+
+
+class Upload:
+    """One uploaded file, hashed and size-checked as its chunks are written
+
+    Content stays in memory up to memory_limit bytes and then moves to a
+    uniquely named spool file. Werkzeug writes multipart file parts
+    straight into it (see UploadRequest), so the request body is read
+    once and nothing is copied to a second location unless save_as asks
+    for it.
+    """
+
+    def __init__(self, filename=None, memory_limit=UPLOAD_MEMORY_LIMIT, max_bytes=MAX_UPLOAD_BYTES,
+                 spool_dir=UPLOAD_SPOOL_DIR):
+        self.filename = filename
+        self.memory_limit = memory_limit
+        self.max_bytes = max_bytes
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.path = None  # Set once the content is on disk
+        self._digest = hashlib.sha256()
+        self._file = io.BytesIO()
+        self._saved = False
+        self._references = 1  # The request closes one; retain() adds more
+
+    @property
+    def content_hash(self):
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            # The parser drops a part that fails mid-write, so nothing else would remove its spool file
+            self.close()
+            raise UploadTooLarge(self.max_bytes)
+        self._digest.update(data)
+        if self.path is None and self.size > self.memory_limit:
+            self._spool()
+        return self._file.write(data)
+
+    def _spool(self):
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, prefix='upload-',
+                                    suffix=os.path.splitext(self.filename or '')[1].lower())
+        spooled = os.fdopen(fd, 'w+b')
+        spooled.write(self._file.getbuffer())
+        self._file = spooled
+        self.path = path
+
+    # Werkzeug reads it back through the usual file methods
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def reader(self):
+        """A new binary file object over the complete content, independent of other readers"""
+        if self.path is None:
+            return io.BytesIO(self._file.getvalue())
+        self._file.flush()
+        return open(self.path, 'rb')
+
+    def getvalue(self):
+        with self.reader() as f:
+            return f.read()
+
+    def save_as(self, folder):
+        """Keep the content under a unique name in folder and return that path"""
+        target = unique_path(folder, self.filename)
+        if self.path is None:
+            with open(target, 'wb') as f:
+                f.write(self._file.getbuffer())
+        else:
+            # A spooled file is moved into place, not copied
+            self._file.close()
+            shutil.move(self.path, target)
+            self._file = open(target, 'rb')
+        self.path = target
+        self._saved = True
+        return target
+
+    def retain(self):
+        """Keep the content past one more close(), e.g. for a response that is still reading it"""
+        self._references += 1
+        return self
+
+    def close(self):
+        """Release one reference; the last frees the content and deletes a spool file that was not saved"""
+        self._references -= 1
+        if self._references > 0:
+            return
+        self._file.close()
+        if self.path is not None and not self._saved and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def receive_upload(file):
+    """Return the Upload behind a FileStorage, streaming it in chunks if it was parsed elsewhere"""
+    if isinstance(file.stream, Upload):
+        return file.stream
+    upload = Upload(file.filename)
+    try:
+        for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+            upload.write(chunk)
+    except Exception:
+        upload.close()
+        raise
+    upload.seek(0)
+    return upload
+
+
+def open_source(source):
+    """Binary file object for a saved path or an Upload"""
+    if isinstance(source, Upload):
+        return source.reader()
+    return open(source, 'rb')
+
+
+def path_or_bytes(source):
+    """A path when the content is on disk, otherwise its bytes, for readers that accept either"""
+    if isinstance(source, Upload):
+        return source.path if source.path is not None else source.getvalue()
+    return source
+
+
+class UploadRequest(Request):
+    """Flask request that parses file parts straight into Uploads
+
+    Werkzeug's default buffers each part in a temporary file that handlers
+    then copy somewhere else; writing into an Upload hashes, size-checks
+    and spools the body in the same pass. Spool files are removed when the
+    request is closed, unless a handler retained the Upload.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return Upload(filename)
@@ -0,0 +1,155 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class WriteBehindBuffer:
+    """Queue INSERT rows in process and write them in multi-row batches
+
+    Rows are grouped by statement and flushed with executemany (which
+    MySQL Connector turns into one multi-row INSERT) in a single
+    transaction, when max_batch rows are pending or the oldest row has
+    waited max_delay seconds. A failed flush keeps its rows for the next
+    attempt; once max_pending rows are queued, add() flushes inline so
+    memory stays bounded and callers feel the backpressure.
+    """
+
+    def __init__(self, connect, max_batch=200, max_delay=0.2, max_pending=10000, retry_delay=1.0):
+        self.connect = connect  # Callable returning a pooled-connection context manager
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+
+        self._rows = OrderedDict()  # statement -> [row, ...] in arrival order
+        self._pending = 0
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # One flush at a time keeps per-statement order
+        self._thread = None
+        self._thread_pid = None
+        self._closed = False
+
+        # Stats
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._failures = 0
+        self._inline_flushes = 0
+        self._largest_batch = 0
+
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Started on first use, and again after a fork since threads do not survive one
+        if self._thread is None or self._thread_pid != os.getpid():
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread_pid = os.getpid()
+            self._closed = False
+            self._thread.start()
+
+    def add(self, statement, row):
+        """Queue one row for an INSERT statement with %s placeholders"""
+        with self._cond:
+            self._ensure_thread()
+            self._rows.setdefault(statement, []).append(tuple(row))
+            self._pending += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            # After close() there is no flusher left, so write straight through
+            full = self._pending >= self.max_pending or self._closed
+            if self._pending >= self.max_batch:
+                self._cond.notify()
+        if full:
+            with self._cond:
+                self._inline_flushes += 1
+            self.flush(raise_errors=True)
+
+    def _take(self):
+        with self._cond:
+            rows, self._rows = self._rows, OrderedDict()
+            self._pending = 0
+            self._oldest = None
+            return rows
+
+    def _restore(self, rows):
+        # Put failed rows back in front of anything queued since
+        with self._cond:
+            for statement, queued in self._rows.items():
+                rows.setdefault(statement, []).extend(queued)
+            self._rows = rows
+            self._pending = sum(len(batch) for batch in rows.values())
+            self._oldest = time.monotonic() if self._pending else None
+
+    def flush(self, raise_errors=False):
+        """Write every queued row now; returns the number of rows written"""
+        with self._flush_lock:
+            rows = self._take()
+            count = sum(len(batch) for batch in rows.values())
+            if not count:
+                return 0
+            try:
+                with self.connect() as conn:
+                    cursor = conn.cursor()
+                    for statement, batch in rows.items():
+                        for start in range(0, len(batch), self.max_batch):
+                            cursor.executemany(statement, batch[start:start + self.max_batch])
+                    conn.commit()
+                    cursor.close()
+            except Exception as e:
+                self._restore(rows)
+                with self._cond:
+                    self._failures += 1
+                print(f"Error flushing {count} buffered rows: {e}")
+                if raise_errors:
+                    raise
+                return 0
+            with self._cond:
+                self._flushes += 1
+                self._flushed_rows += count
+                self._largest_batch = max(self._largest_batch, count)
+            return count
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending >= self.max_batch:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            if not self.flush():
+                # Back off after a failure instead of hammering the database
+                with self._cond:
+                    if self._pending:
+                        self._cond.wait(self.retry_delay)
+
+    def close(self):
+        """Stop the flusher and write whatever is still queued"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread if self._thread_pid == os.getpid() else None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'flushes': self._flushes,
+                'flushed_rows': self._flushed_rows,
+                'failures': self._failures,
+                'inline_flushes': self._inline_flushes,
+                'largest_batch': self._largest_batch,
+                'mean_batch': self._flushed_rows / self._flushes if self._flushes else 0.0,
+            }